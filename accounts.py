@@ -0,0 +1,87 @@
+import hashlib
+import logging
+import time
+
+from config import ACCOUNTS
+
+logger = logging.getLogger(__name__)
+
+
+class Account:
+    """One TeraBox login (its ndus cookie) and how it is doing."""
+
+    def __init__(self, cookie: str):
+        cookie = cookie.strip()
+        self.cookie = cookie if "=" in cookie else f"ndus={cookie}"
+        # stable id that can be stored with a task without leaking the cookie
+        self.name = hashlib.sha1(self.cookie.encode()).hexdigest()[:8]
+        self.active = 0
+        self.failures = 0
+        self.throttled = 0
+        self.disabled_until = 0.0
+        self.bytes = 0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.disabled_until
+
+
+class AccountPool:
+    """
+    Spreads tasks over several TeraBox accounts so each one's bandwidth quota
+    only carries part of the load.
+
+    acquire() hands out the healthy account with the fewest running tasks.
+    After ACCOUNTS.MAX_FAILURES consecutive failures an account is taken out of
+    rotation for ACCOUNTS.COOLDOWN seconds and then tried again. With every
+    account out of rotation the one coming back first is used.
+    """
+
+    def __init__(self, cookies, max_failures: int = ACCOUNTS.MAX_FAILURES, cooldown: int = ACCOUNTS.COOLDOWN):
+        self.accounts = []
+        seen = set()
+        for cookie in cookies:
+            account = Account(cookie)
+            if account.name not in seen:
+                seen.add(account.name)
+                self.accounts.append(account)
+        if not self.accounts:
+            raise ValueError("No TeraBox account cookies configured")
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+
+    def get(self, name: str):
+        for account in self.accounts:
+            if account.name == name:
+                return account
+        return None
+
+    def pick(self, prefer: str = None) -> Account:
+        """Least-loaded healthy account; `prefer` wins while it is healthy (its dlinks stay valid)."""
+        preferred = self.get(prefer) if prefer else None
+        if preferred and preferred.healthy:
+            return preferred
+        healthy = [a for a in self.accounts if a.healthy]
+        if not healthy:
+            return min(self.accounts, key=lambda a: a.disabled_until)
+        return min(healthy, key=lambda a: (a.active, a.failures))
+
+    def acquire(self, prefer: str = None) -> Account:
+        account = self.pick(prefer)
+        account.active += 1
+        return account
+
+    def release(self, account: Account):
+        account.active = max(0, account.active - 1)
+
+    def success(self, account: Account):
+        account.failures = 0
+
+    def failure(self, account: Account, throttled: bool = False):
+        account.failures += 1
+        if throttled:
+            account.throttled += 1
+        if account.failures >= self.max_failures and len(self.accounts) > 1:
+            account.failures = 0
+            account.disabled_until = time.monotonic() + self.cooldown
+            logger.warning(f"TeraBox account {account.name} failing, out of rotation for {self.cooldown}s")
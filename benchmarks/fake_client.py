@@ -0,0 +1,133 @@
+"""
+Pyrogram stand-in for benchmarks: records uploads instead of talking to Telegram.
+
+Only the calls the transfer path makes are implemented: send_message,
+send_video/send_document (reading the file in upload-part sized pieces and
+calling the progress callback like Pyrogram does), message edits, deletes and
+server-side copies, plus the raw SaveFilePart/SaveBigFilePart/SendMedia
+calls, rnd_id and resolve_peer the pipelined upload (UPLOAD_PIPELINE) uses.
+"""
+import asyncio
+import itertools
+import os
+import random
+import time
+from types import SimpleNamespace
+
+from pyrogram import raw
+
+UPLOAD_PART = 512 * 1024
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, client: "FakeClient", chat_id: int, text: str = "", media=None):
+        self.client = client
+        self.id = next(self._ids)
+        self.chat = SimpleNamespace(id=chat_id)
+        self.text = text
+        self.empty = False
+        self.video = media if media and media.kind == "video" else None
+        self.document = media if media and media.kind == "document" else None
+
+    async def edit_text(self, text: str, reply_markup=None, **kwargs):
+        self.client.edits += 1
+        self.text = text
+        return self
+
+    async def delete(self):
+        self.client.deleted += 1
+
+    async def copy(self, chat_id: int, **kwargs):
+        self.client.copies += 1
+        return FakeMessage(self.client, chat_id, self.text, self.video or self.document)
+
+
+class FakeClient:
+    """
+    upload_bandwidth caps the simulated Telegram upload in bytes/s (0 for
+    disk speed only).
+    """
+
+    def __init__(self, upload_bandwidth: float = 0.0):
+        self.upload_bandwidth = upload_bandwidth
+        self.uploads = []
+        self.messages = 0
+        self.edits = 0
+        self.copies = 0
+        self.deleted = 0
+        self.is_connected = True
+        # file_id -> {"began", "size"} of raw uploads still receiving parts
+        self.parts = {}
+
+    async def _pace(self, began: float, size: int):
+        """Sleep until `size` bytes fit the simulated bandwidth since `began`."""
+        if self.upload_bandwidth:
+            ahead = size / self.upload_bandwidth - (time.monotonic() - began)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+
+    def _record(self, chat_id: int, file_name: str, kind: str, size: int, began: float) -> FakeMessage:
+        self.uploads.append({
+            "chat_id": chat_id, "file_name": file_name, "size": size, "seconds": time.monotonic() - began,
+        })
+        media = SimpleNamespace(kind=kind, file_id=f"fake-{len(self.uploads)}", file_size=size)
+        return FakeMessage(self, chat_id, file_name, media)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.messages += 1
+        return FakeMessage(self, chat_id, text)
+
+    async def _upload(self, chat_id: int, path: str, kind: str, file_name: str, progress=None):
+        began = time.monotonic()
+        total = os.path.getsize(path)
+        size = 0
+        loop = asyncio.get_running_loop()
+        with open(path, "rb") as f:
+            while True:
+                part = await loop.run_in_executor(None, f.read, UPLOAD_PART)
+                if not part:
+                    break
+                size += len(part)
+                await self._pace(began, size)
+                if progress:
+                    await progress(size, total)
+        return self._record(chat_id, file_name, kind, size, began)
+
+    async def send_video(self, chat_id: int, video: str, file_name: str = None, progress=None, **kwargs):
+        return await self._upload(chat_id, video, "video", file_name, progress)
+
+    async def send_document(self, chat_id: int, document: str, file_name: str = None, progress=None, **kwargs):
+        return await self._upload(chat_id, document, "document", file_name, progress)
+
+    async def get_messages(self, chat_id: int, message_ids):
+        return None
+
+    def rnd_id(self) -> int:
+        return random.randint(-2 ** 63, 2 ** 63 - 1)
+
+    async def resolve_peer(self, peer_id: int):
+        return SimpleNamespace(chat_id=peer_id)
+
+    async def invoke(self, query):
+        if isinstance(query, (raw.functions.upload.SaveFilePart, raw.functions.upload.SaveBigFilePart)):
+            upload = self.parts.setdefault(query.file_id, {"began": time.monotonic(), "size": 0})
+            upload["size"] += len(query.bytes)
+            await self._pace(upload["began"], upload["size"])
+            return True
+        if isinstance(query, raw.functions.messages.SendMedia):
+            media = query.media
+            upload = self.parts.pop(media.file.id, {"began": time.monotonic(), "size": 0})
+            is_video = any(isinstance(a, raw.types.DocumentAttributeVideo) for a in media.attributes)
+            msg = self._record(
+                query.peer.chat_id, media.file.name, "video" if is_video else "document", upload["size"], upload["began"]
+            )
+            # what parse_sent_message below turns back into the message
+            return SimpleNamespace(message=msg)
+        raise NotImplementedError(f"FakeClient does not implement {type(query).__name__}")
+
+
+async def parse_sent_message(client: FakeClient, updates) -> FakeMessage:
+    """Stand-in for plugins.tera.parse_sent_message, which needs real Telegram updates."""
+    return updates.message
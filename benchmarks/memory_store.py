@@ -0,0 +1,155 @@
+"""
+In-memory stand-ins for the Mongo-backed TaskStore and FileCache, so the
+benchmark drives the real DownloadQueue without a database.
+
+One process owns every task here: claims always succeed for queued tasks,
+leases and user locks never run out, and nothing is shared between runs.
+"""
+import asyncio
+import itertools
+import time
+
+from config import WORKER
+from plugins.tera import TaskStore, FileCache
+
+
+class MemoryTaskStore(TaskStore):
+    def __init__(self):
+        super().__init__("tasks", "cooldowns", "user_locks")
+        self.docs = {}
+        self.last_download = {}
+        self._ids = itertools.count(1)
+
+    def _find(self, **match) -> list:
+        docs = [d for d in self.docs.values() if all(d.get(k) == v for k, v in match.items())]
+        return [dict(d) for d in sorted(docs, key=lambda d: (d["user_id"], d["seq"]))]
+
+    @staticmethod
+    async def _forever():
+        while True:
+            await asyncio.sleep(3600)
+
+    async def add(self, user_id: int, task: dict, is_admin: bool):
+        doc = self._task_doc(user_id, task, is_admin)
+        doc["_id"] = next(self._ids)
+        self.docs[doc["_id"]] = doc
+        task["_id"] = doc["_id"]
+
+    async def add_many(self, user_id: int, tasks: list, is_admin: bool):
+        for task in tasks:
+            await self.add(user_id, task, is_admin)
+
+    async def claim(self, task: dict) -> bool:
+        doc = self.docs.get(task.get("_id"))
+        if doc is None:
+            return "_id" not in task
+        if doc["state"] not in ("queued", "running"):
+            return False
+        doc.update(state="running", worker=WORKER.ID, started_at=time.time())
+        return True
+
+    async def keep_leased(self, task: dict, on_lost=None):
+        await self._forever()
+
+    async def lock_user(self, user_id: int) -> bool:
+        return True
+
+    async def keep_user_locked(self, user_id: int):
+        await self._forever()
+
+    async def unlock_user(self, user_id: int):
+        pass
+
+    async def release_worker(self):
+        for doc in self.docs.values():
+            if doc["state"] == "running":
+                doc.update(state="queued", worker=None)
+
+    async def claimable_users(self) -> list:
+        return sorted({d["user_id"] for d in self.docs.values() if d["state"] == "queued"})
+
+    async def load_user_tasks(self, user_id: int) -> list:
+        return self._find(user_id=user_id, state="queued")
+
+    async def active_urls(self, user_id: int) -> set:
+        return {d["url"] for d in self._find(user_id=user_id) if d["state"] in ("queued", "running")}
+
+    async def count_active(self, user_id: int) -> int:
+        return sum(1 for d in self._find(user_id=user_id) if d["state"] in ("queued", "running"))
+
+    async def last_seq(self, user_id: int) -> float:
+        return max((d["seq"] for d in self._find(user_id=user_id) if d["state"] in ("queued", "running")), default=0)
+
+    async def queue_position(self, task: dict) -> int:
+        return sum(1 for d in self.docs.values() if d["state"] == "queued" and d["seq"] <= task["seq"])
+
+    async def set_state(self, task: dict, state: str, error: str = None):
+        doc = self.docs.get(task.get("_id"))
+        if doc is None:
+            return
+        doc.update(state=state, finished_at=time.time())
+        if error:
+            doc["error"] = str(error)[:500]
+
+    async def save_info(self, task: dict):
+        if task.get("_id") in self.docs:
+            self.docs[task["_id"]]["info"] = task["info"]
+
+    async def mark_expanded(self, task: dict):
+        if task.get("_id") in self.docs:
+            self.docs[task["_id"]]["expanded"] = True
+
+    async def cancel_user(self, user_id: int):
+        for doc in self.docs.values():
+            if doc["user_id"] == user_id and doc["state"] in ("queued", "running"):
+                doc.update(state="cancelled", finished_at=time.time())
+
+    async def known_fs_ids(self, user_id: int, url: str) -> set:
+        return {d["info"]["fs_id"] for d in self._find(user_id=user_id, url=url) if d["info"]}
+
+    async def set_cooldown(self, user_id: int, timestamp: float):
+        self.last_download[user_id] = timestamp
+
+    async def load_pending(self, worker: str = None) -> list:
+        docs = [
+            d for d in self._find()
+            if d["state"] in ("queued", "running")
+            or (not d["expanded"] and d["info"] is not None and d["state"] != "cancelled")
+        ]
+        return [d for d in docs if d["worker"] == worker] if worker else docs
+
+    async def load_unexpanded(self, user_id: int) -> list:
+        return [
+            d for d in self._find(user_id=user_id, expanded=False)
+            if d["info"] is not None and d["state"] != "cancelled"
+        ]
+
+    async def load_cooldowns(self, user_ids) -> dict:
+        return {uid: self.last_download[uid] for uid in user_ids if uid in self.last_download}
+
+    def states(self) -> dict:
+        counts = {}
+        for doc in self.docs.values():
+            counts[doc["state"]] = counts.get(doc["state"], 0) + 1
+        return counts
+
+    def failures(self) -> list:
+        return [d for d in self._find() if d["state"] == "failed"]
+
+
+class MemoryFileCache(FileCache):
+    def __init__(self):
+        super().__init__("file_cache")
+        self.entries = {}
+
+    async def get(self, client, info: dict):
+        if not info.get("fs_id"):
+            return None
+        return self.entries.get(self.cache_id(info))
+
+    async def put(self, info: dict, msg):
+        if info.get("fs_id") and (msg.video or msg.document):
+            self.entries[self.cache_id(info)] = msg
+
+    async def invalidate(self, info: dict):
+        self.entries.pop(self.cache_id(info), None)
@@ -0,0 +1,246 @@
+"""
+Offline throughput benchmark for the resolve -> download -> upload path.
+
+Starts benchmarks.stub_server in a subprocess, points the bot at it through
+TERABOX_BASE_URL and queues links for N simulated users concurrently. Each
+user's queue is worked through by the real DownloadQueue.process_queue, so
+prefetch, cooldowns, admin parallelism and the scheduler are measured along
+with the resolver, downloader and upload code. A FakeClient stands in for
+Telegram and benchmarks.memory_store for MongoDB. Reports aggregate MB/s,
+per-stage latency percentiles, peak memory and event-loop lag. Needs the
+bot's requirements installed, but no network, Telegram account or MongoDB.
+
+    python -m benchmarks.run --users 8 --links 2 --files 2 --file-size-mb 64 --bandwidth-mbps 20
+
+Downloader settings come from the usual environment variables
+(DOWNLOAD_CONNECTIONS, DOWNLOAD_SEGMENT_MB, ...).
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline TeraBox bot benchmark")
+    parser.add_argument("--users", type=int, default=4, help="concurrent users")
+    parser.add_argument("--links", type=int, default=1, help="share links queued per user")
+    parser.add_argument("--files", type=int, default=1, help="files per share")
+    parser.add_argument("--file-size-mb", type=float, default=32)
+    parser.add_argument("--latency-ms", type=float, default=20, help="stub response latency")
+    parser.add_argument("--bandwidth-mbps", type=float, default=0, help="stub MB/s per connection, 0 for unlimited")
+    parser.add_argument("--upload-mbps", type=float, default=0, help="fake Telegram upload MB/s, 0 for unlimited")
+    parser.add_argument("--max-concurrent", type=int, default=None, help="global transfer slots (default: config)")
+    parser.add_argument("--admin", action="store_true", help="users are admins: priority lane, parallel tasks")
+    parser.add_argument("--cooldown", type=int, default=0, help="seconds between two tasks of a non-admin user")
+    parser.add_argument("--pipeline", action="store_true", help="stream into the upload without a temp file")
+    parser.add_argument("--no-range", action="store_true", help="stub ignores Range, forcing single-stream downloads")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args()
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summary(values) -> dict:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 4),
+        "p90": round(percentile(values, 90), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+
+class Timings:
+    def __init__(self):
+        self.stages = defaultdict(list)
+
+    def stage(self, name: str):
+        return _Stage(self.stages[name])
+
+
+def timed(timings: Timings, name: str, fn):
+    """Wrap a coroutine function so every successful call is recorded as stage `name`."""
+    async def wrapper(*args, **kwargs):
+        with timings.stage(name):
+            return await fn(*args, **kwargs)
+    return wrapper
+
+
+class _Stage:
+    def __init__(self, sink: list):
+        self.sink = sink
+
+    def __enter__(self):
+        self.start = time.monotonic()
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.sink.append(time.monotonic() - self.start)
+        return False
+
+
+async def monitor_lag(samples: list, interval: float = 0.05):
+    """How late the loop wakes a sleeping task: a direct measure of blocking work."""
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        samples.append(time.monotonic() - start - interval)
+
+
+def start_stub(args) -> subprocess.Popen:
+    cmd = [
+        sys.executable, "-m", "benchmarks.stub_server",
+        "--port", str(args.port),
+        "--files", str(args.files),
+        "--file-size-mb", str(args.file_size_mb),
+        "--latency-ms", str(args.latency_ms),
+        "--bandwidth-mbps", str(args.bandwidth_mbps),
+    ]
+    if args.no_range:
+        cmd.append("--no-range")
+    return subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+
+
+async def wait_for_port(port: int, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"stub server did not come up on port {port}")
+            await asyncio.sleep(0.1)
+
+
+async def run_user(queue, client, links: list, user_id: int, admin: bool):
+    """What handle_terabox does for one message: queue the links, then work through them."""
+    await queue.add_tasks(user_id, admin, links)
+    await queue.process_queue(client, user_id)
+
+
+async def bench(args) -> dict:
+    from benchmarks import fake_client
+    from benchmarks.memory_store import MemoryTaskStore, MemoryFileCache
+    import plugins.tera as tera
+
+    await wait_for_port(args.port)
+    tera.QUEUE.COOLDOWN = args.cooldown
+    # non-admins get only USER_LIMIT links queued
+    tera.QUEUE.USER_LIMIT = max(tera.QUEUE.USER_LIMIT, args.links)
+    if args.pipeline:
+        tera.UPLOAD.PIPELINE = True
+    store = MemoryTaskStore()
+    queue = tera.DownloadQueue(store, args.max_concurrent or tera.QUEUE.MAX_CONCURRENT)
+    # the transfer code reaches both through module globals
+    tera.queue = queue
+    tera.file_cache = MemoryFileCache()
+    tera.parse_sent_message = fake_client.parse_sent_message
+
+    timings = Timings()
+    queue._resolve = timed(timings, "resolve", queue._resolve)
+    queue.acquire_slot = timed(timings, "slot_wait", queue.acquire_slot)
+    queue.run_task = timed(timings, "task", queue.run_task)
+    tera.download_with_progress = timed(timings, "download", tera.download_with_progress)
+    tera.upload_with_progress = timed(timings, "upload", tera.upload_with_progress)
+    tera.stream_to_telegram = timed(timings, "stream", tera.stream_to_telegram)
+
+    client = fake_client.FakeClient(upload_bandwidth=args.upload_mbps * 1024 * 1024)
+    lag = []
+    monitor = asyncio.create_task(monitor_lag(lag))
+    base = f"http://127.0.0.1:{args.port}"
+
+    started = time.monotonic()
+    await asyncio.gather(*(
+        run_user(
+            queue, client,
+            [tera.normalize_link(f"{base}/s/1bench{u:05d}x{n:03d}") for n in range(args.links)],
+            10_000 + u, args.admin,
+        )
+        for u in range(args.users)
+    ))
+    wall = time.monotonic() - started
+
+    monitor.cancel()
+    await tera.status_renderer.stop()
+    await tera.close_http_session()
+
+    moved = sum(u["size"] for u in client.uploads)
+    return {
+        "users": args.users,
+        "links": args.links,
+        "files": len(client.uploads),
+        "file_size_mb": args.file_size_mb,
+        "max_concurrent": queue.max_concurrent,
+        "download_connections": tera.DOWNLOAD.CONNECTIONS,
+        "pipeline": tera.UPLOAD.PIPELINE,
+        "wall_seconds": round(wall, 3),
+        "throughput_mb_s": round(moved / 1024 / 1024 / wall, 2) if wall else 0.0,
+        "stages_seconds": {name: summary(values) for name, values in timings.stages.items()},
+        "loop_lag_seconds": summary(lag),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "status_edits": client.edits,
+        "tasks": store.states(),
+        "errors": [
+            f"{(d['info'] or {}).get('name', d['url'])}: {d.get('error', 'failed')}" for d in store.failures()
+        ],
+    }
+
+
+def print_report(report: dict):
+    print(
+        f"{report['users']} users x {report['links']} links, {report['files']} files of {report['file_size_mb']} MB, "
+        f"{report['max_concurrent']} slots, {report['download_connections']} connections/file"
+        + (", pipelined" if report["pipeline"] else "")
+    )
+    print(f"wall {report['wall_seconds']}s, throughput {report['throughput_mb_s']} MB/s, "
+          f"peak RSS {report['peak_rss_mb']} MB, {report['status_edits']} status edits")
+    print("tasks " + ", ".join(f"{n} {state}" for state, n in sorted(report["tasks"].items())))
+    print(f"{'stage':<12}{'count':>7}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    rows = dict(report["stages_seconds"], loop_lag=report["loop_lag_seconds"])
+    for name, s in rows.items():
+        print(f"{name:<12}{s['count']:>7}{s['p50']:>10.3f}{s['p90']:>10.3f}{s['p99']:>10.3f}{s['max']:>10.3f}")
+    for error in report["errors"]:
+        print(f"error: {error}")
+
+
+def main():
+    args = parse_args()
+    temp_dir = tempfile.mkdtemp(prefix="mn-bench-")
+    # must be set before the bot modules read their config
+    os.environ["TERABOX_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ["TEMP_DIR"] = temp_dir
+    os.environ.setdefault("TEMP_MIN_FREE_MB", "0")
+
+    stub = start_stub(args)
+    try:
+        report = asyncio.run(bench(args))
+    finally:
+        stub.terminate()
+        stub.wait()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Local stand-in for the TeraBox web API and CDN.
+
+Serves the three things the bot talks to:
+
+* /s/1<surl>             share link, redirects to the share page
+* /sharing/link?surl=..  share page HTML carrying the auth tokens
+* /share/list            file listing JSON, paginated like the real API
+* /file/<surl>/<fs_id>   file bodies with HTTP Range support
+
+Every share holds `files` files of `file_size` bytes. Responses are delayed by
+`latency` seconds and file bodies are sent at `bandwidth` bytes/s per
+connection (0 for unlimited). Run standalone with:
+
+    python -m benchmarks.stub_server --port 8765 --files 3 --file-size-mb 64
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from aiohttp import web
+
+BLOCK = os.urandom(1024 * 1024)
+SEND_CHUNK = 64 * 1024
+
+
+def file_bytes(start: int, end: int) -> bytes:
+    """Deterministic body bytes start..end (inclusive), a repeated random block."""
+    out = bytearray()
+    pos = start
+    while pos <= end:
+        offset = pos % len(BLOCK)
+        take = min(len(BLOCK) - offset, end + 1 - pos)
+        out += BLOCK[offset:offset + take]
+        pos += take
+    return bytes(out)
+
+
+class StubTerabox:
+    def __init__(self, files: int = 1, file_size: int = 64 * 1024 * 1024, latency: float = 0.0,
+                 bandwidth: float = 0.0, range_support: bool = True):
+        self.files = files
+        self.file_size = file_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.range_support = range_support
+        self.requests = {"share_page": 0, "share_list": 0, "file": 0}
+        self.bytes_sent = 0
+        self.base_url = None
+        self.runner = None
+
+    # ---------- handlers ----------
+    async def share_link(self, request):
+        await asyncio.sleep(self.latency)
+        surl = request.match_info["surl"]
+        raise web.HTTPFound(f"/sharing/link?surl={surl}")
+
+    async def share_page(self, request):
+        self.requests["share_page"] += 1
+        await asyncio.sleep(self.latency)
+        html = (
+            "<html><script>"
+            'var a = "fn%28%22stubjstoken%22%29";'
+            'var b = "dp-logid=stublogid&x=1";'
+            'var c = {"bdstoken":"stubbdstoken"};'
+            "</script></html>"
+        )
+        return web.Response(text=html, content_type="text/html")
+
+    def entry(self, surl: str, index: int) -> dict:
+        fs_id = f"{surl}{index:04d}"
+        dstime = int(time.time())
+        return {
+            "server_filename": f"{surl}_{index:04d}.mkv",
+            "size": self.file_size,
+            "fs_id": fs_id,
+            "md5": f"stub{fs_id}",
+            "isdir": 0,
+            "path": f"/{surl}/{index}",
+            "dlink": f"{self.base_url}/file/{surl}/{fs_id}?dstime={dstime}&expires=8h",
+        }
+
+    async def share_list(self, request):
+        self.requests["share_list"] += 1
+        await asyncio.sleep(self.latency)
+        surl = request.query.get("shorturl", "")
+        page = int(request.query.get("page", 1))
+        num = int(request.query.get("num", 100))
+        first = (page - 1) * num
+        entries = [self.entry(surl, i) for i in range(first, min(first + num, self.files))]
+        return web.json_response({"errno": 0, "list": entries})
+
+    async def file(self, request):
+        self.requests["file"] += 1
+        await asyncio.sleep(self.latency)
+        total = self.file_size
+        start, end = 0, total - 1
+        status = 200
+        range_header = request.headers.get("Range")
+        if range_header and self.range_support:
+            spec = range_header.split("=", 1)[1]
+            first, _, last = spec.partition("-")
+            start = int(first)
+            end = min(int(last), total - 1) if last else total - 1
+            status = 206
+
+        resp = web.StreamResponse(status=status)
+        resp.content_length = end - start + 1
+        resp.content_type = "application/octet-stream"
+        if status == 206:
+            resp.headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+        await resp.prepare(request)
+
+        pos = start
+        began = time.monotonic()
+        while pos <= end:
+            chunk_end = min(pos + SEND_CHUNK, end + 1) - 1
+            await resp.write(file_bytes(pos, chunk_end))
+            self.bytes_sent += chunk_end + 1 - pos
+            pos = chunk_end + 1
+            if self.bandwidth:
+                # pace this connection to the configured rate
+                ahead = (pos - start) / self.bandwidth - (time.monotonic() - began)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        await resp.write_eof()
+        return resp
+
+    # ---------- lifecycle ----------
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.get("/s/1{surl}", self.share_link),
+            web.get("/sharing/link", self.share_page),
+            web.get("/share/list", self.share_list),
+            web.get("/file/{surl}/{fs_id}", self.file),
+        ])
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765):
+        self.base_url = f"http://{host}:{port}"
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def share_url(self, index: int) -> str:
+        return f"{self.base_url}/s/1bench{index:05d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local TeraBox stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--files", type=int, default=1, help="files per share")
+    parser.add_argument("--file-size-mb", type=float, default=64)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--bandwidth-mbps", type=float, default=0, help="MB/s per connection, 0 for unlimited")
+    parser.add_argument("--no-range", action="store_true", help="ignore Range headers")
+    args = parser.parse_args()
+
+    stub = StubTerabox(
+        files=args.files,
+        file_size=int(args.file_size_mb * 1024 * 1024),
+        latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_mbps * 1024 * 1024,
+        range_support=not args.no_range,
+    )
+
+    async def serve():
+        await stub.start(args.host, args.port)
+        print(f"Stub TeraBox on {stub.base_url}, e.g. {stub.share_url(0)}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,40 @@
+import asyncio
 import logging
-import threading
-from flask import Flask
 from pyrogram import Client, utils as pyroutils
-from config import BOT, API, OWNER
+from config import BOT, API, OWNER, WORKER
+from plugins.tera import close_http_session, queue
+from status import status_renderer
+from database import database
+from verify_patch import close_shortlink_session
+from storage import temp_storage
+from web import WebServer
 
 
 logging.getLogger().setLevel(logging.INFO)
 logging.getLogger("pyrogram").setLevel(logging.ERROR)
 
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return "MnBot is running!"
-
-def run_flask():
-    app.run(host='0.0.0.0', port=9090)
-
 class MN_Bot(Client):
     def __init__(self):
+        is_worker = WORKER.ROLE == "worker"
         super().__init__(
-            "MN-Bot",
+            # every worker process needs its own session file
+            f"MN-Bot-{WORKER.ID}" if is_worker else "MN-Bot",
             api_id=API.ID,
             api_hash=API.HASH,
             bot_token=BOT.TOKEN,
             plugins=dict(root="plugins"),
             workers=16,
+            # updates are handled by the front process only
+            no_updates=is_worker,
         )
+        self.worker_task = None
+        self.web = WebServer(self)
 
     async def start(self):
+        # handlers may hit the database as soon as the client starts
+        await database.connect()
+        # up before Telegram so /ready can report the connection state
+        await self.web.start()
         await super().start()
         me = await self.get_me()
         BOT.USERNAME = f"@{me.username}"
@@ -36,12 +42,29 @@ class MN_Bot(Client):
         self.username = me.username
         await self.send_message(chat_id=OWNER.ID,
                                 text=f"{me.first_name} ✅✅ BOT started successfully ✅✅")
+        if WORKER.ROLE != "front":
+            # drop temp files left behind by earlier runs, then keep sweeping
+            temp_storage.start()
+            # pick up tasks that were pending when the bot last went down
+            await queue.recover(self)
+            # retries tasks and users still leased by a process that died
+            self.worker_task = asyncio.create_task(queue.run_worker(self))
         logging.info(f"✅ {me.first_name} BOT started successfully")
 
     async def stop(self, *args):
+        if self.worker_task:
+            self.worker_task.cancel()
+        if WORKER.ROLE != "front":
+            # running tasks go back to queued so a restart resumes them at once
+            await queue.stop()
+        await status_renderer.stop()
+        await temp_storage.stop()
+        await close_http_session()
+        await close_shortlink_session()
         await super().stop()
+        await self.web.stop()
+        await database.close()
         logging.info("Bot Stopped 🙄")
 
 if __name__ == "__main__":
-    threading.Thread(target=run_flask).start()
     MN_Bot().run()
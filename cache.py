@@ -0,0 +1,80 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one in-flight call."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, loader):
+        fut = self._calls.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(loader())
+            self._calls[key] = fut
+            fut.add_done_callback(lambda _: self._calls.pop(key, None))
+        # shield: one waiter being cancelled must not cancel the shared call
+        return await asyncio.shield(fut)
+
+
+class TTLCache:
+    """
+    LRU mapping whose entries also expire ttl seconds after they were stored.
+    get_or_load fills missing keys through a single-flight loader, so concurrent
+    misses for one key share a single request.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+    async def get_or_load(self, key, loader, ttl: float = None):
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        async def load():
+            value = await loader()
+            self.set(key, value, ttl)
+            return value
+
+        return await self._flight.do(key, load)
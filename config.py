@@ -2,6 +2,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import socket
+import tempfile
 
 class BOT:
     TOKEN = os.environ.get("TOKEN", "")
@@ -15,10 +17,123 @@ class OWNER:
 
 class CHANNEL:
     ID = int(os.environ.get("CHANNEL_ID", 0))
+    # extra chats that get a server-side copy of every file, comma separated ids
+    MIRRORS = [int(x) for x in os.environ.get("MIRROR_CHANNELS", "").replace(" ", "").split(",") if x]
 
 class WEB:
     PORT = int(os.environ.get("PORT", 9090))
+    # bearer token for the /admin endpoints, which are disabled while empty
+    ADMIN_TOKEN = os.environ.get("WEB_ADMIN_TOKEN", "")
+    # /ready reports not ready once this many tasks are queued in the process
+    MAX_BACKLOG = int(os.environ.get("READY_MAX_BACKLOG", 500))
 
 class DATABASE:
     URI = os.environ.get("DB_URI", "")
     NAME = os.environ.get("DB_NAME", "MN_Bot_DB")
+    # one pooled client is shared by the whole process
+    POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 50))
+    MIN_POOL_SIZE = int(os.environ.get("DB_MIN_POOL_SIZE", 2))
+    TIMEOUT = int(os.environ.get("DB_TIMEOUT", 10))
+
+class QUEUE:
+    MAX_CONCURRENT = int(os.environ.get("MAX_CONCURRENT_DOWNLOADS", 4))
+    USER_LIMIT = int(os.environ.get("USER_QUEUE_LIMIT", 5))
+    COOLDOWN = int(os.environ.get("USER_COOLDOWN", 30))
+    # extra files queued from one folder/multi-file share for non-admins
+    SHARE_FILE_LIMIT = int(os.environ.get("SHARE_FILE_LIMIT", 50))
+    # seconds a worker owns a claimed task without renewing it
+    LEASE = int(os.environ.get("TASK_LEASE", 120))
+    # upcoming links of a user resolved while the current file transfers
+    PREFETCH = int(os.environ.get("QUEUE_PREFETCH", 2))
+    # files of one admin downloading side by side
+    ADMIN_PARALLEL = int(os.environ.get("ADMIN_PARALLEL_TASKS", 2))
+
+class DOWNLOAD:
+    # max parallel HTTP Range connections per file (1 disables segmented mode)
+    CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", 8))
+    # connections a segmented download starts with before adapting
+    START_CONNECTIONS = int(os.environ.get("DOWNLOAD_START_CONNECTIONS", 2))
+    SEGMENT_SIZE = int(os.environ.get("DOWNLOAD_SEGMENT_MB", 8)) * 1024 * 1024
+    SEGMENT_RETRIES = int(os.environ.get("DOWNLOAD_SEGMENT_RETRIES", 5))
+    # attempts per task, each one resumes from the on-disk journal
+    RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", 4))
+    # bytes collected per stream before one pwrite, and threads doing the writes
+    WRITE_BUFFER = int(os.environ.get("DOWNLOAD_WRITE_BUFFER_KB", 1024)) * 1024
+    IO_THREADS = int(os.environ.get("DOWNLOAD_IO_THREADS", 2))
+
+class STORAGE:
+    # directory downloads are written to, only this bot should use it
+    DIR = os.environ.get("TEMP_DIR") or os.path.join(tempfile.gettempdir(), "mn-terabox")
+    # max bytes of temp files, 0 for no quota (free disk space is always checked)
+    QUOTA = int(os.environ.get("TEMP_QUOTA_MB", 0)) * 1024 * 1024
+    # disk space left untouched for the OS and other processes
+    MIN_FREE = int(os.environ.get("TEMP_MIN_FREE_MB", 500)) * 1024 * 1024
+    # files no task holds are deleted after this many seconds
+    ORPHAN_AGE = int(os.environ.get("TEMP_ORPHAN_HOURS", 12)) * 3600
+
+class UPLOAD:
+    # stream the download straight into Telegram upload parts, no temp file
+    PIPELINE = os.environ.get("UPLOAD_PIPELINE", "False").lower() in ("true", "1", "yes")
+    # size of the in-memory buffer between the download and the uploaders
+    PIPELINE_BUFFER = int(os.environ.get("UPLOAD_PIPELINE_BUFFER_MB", 16)) * 1024 * 1024
+    PIPELINE_WORKERS = int(os.environ.get("UPLOAD_PIPELINE_WORKERS", 4))
+
+class MEDIA:
+    # read duration, size and a thumbnail of videos with ffprobe/ffmpeg before upload
+    PROBE = os.environ.get("MEDIA_PROBE", "True").lower() in ("true", "1", "yes")
+    # remux videos to MP4 with the index in front (stream copy, no re-encoding)
+    FASTSTART = os.environ.get("MEDIA_FASTSTART", "False").lower() in ("true", "1", "yes")
+    # smaller files start playing quickly anyway
+    FASTSTART_MIN_SIZE = int(os.environ.get("MEDIA_FASTSTART_MIN_MB", 20)) * 1024 * 1024
+    # ffprobe/ffmpeg processes running at once, and how long one may take
+    CONCURRENCY = int(os.environ.get("MEDIA_CONCURRENCY", 2))
+    TIMEOUT = int(os.environ.get("MEDIA_TIMEOUT", 60))
+    REMUX_TIMEOUT = int(os.environ.get("MEDIA_REMUX_TIMEOUT", 900))
+
+class RESOLVER:
+    # TeraBox web API host; point it at a local stub for benchmarks
+    BASE_URL = os.environ.get("TERABOX_BASE_URL", "https://www.terabox.app").rstrip("/")
+    # pooled connections shared by all share page and /share/list requests
+    CONNECTIONS = int(os.environ.get("RESOLVER_CONNECTIONS", 20))
+    CONNECTIONS_PER_HOST = int(os.environ.get("RESOLVER_CONNECTIONS_PER_HOST", 8))
+    TIMEOUT = int(os.environ.get("RESOLVER_TIMEOUT", 30))
+    RETRIES = int(os.environ.get("RESOLVER_RETRIES", 3))
+    # share page tokens are reused across links for this many seconds
+    TOKEN_TTL = int(os.environ.get("RESOLVER_TOKEN_TTL", 600))
+    # resolved file info per share surl
+    INFO_TTL = int(os.environ.get("RESOLVER_INFO_TTL", 300))
+    CACHE_SIZE = int(os.environ.get("RESOLVER_CACHE_SIZE", 1024))
+
+class LIMITS:
+    # requests/s and max requests in flight per TeraBox endpoint; rates are
+    # ceilings, they are halved on 429/errno and recover gradually
+    SHARE_PAGE_RATE = float(os.environ.get("SHARE_PAGE_RATE", 2))
+    SHARE_PAGE_CONCURRENCY = int(os.environ.get("SHARE_PAGE_CONCURRENCY", 4))
+    SHARE_LIST_RATE = float(os.environ.get("SHARE_LIST_RATE", 5))
+    SHARE_LIST_CONCURRENCY = int(os.environ.get("SHARE_LIST_CONCURRENCY", 8))
+    # dlink CDN: new requests/s and open download connections across all files
+    CDN_RATE = float(os.environ.get("CDN_RATE", 20))
+    CDN_CONCURRENCY = int(os.environ.get("CDN_CONCURRENCY", 32))
+
+class ACCOUNTS:
+    # comma separated ndus cookies ("ndus=..." or just the value); tasks are
+    # spread over them least-loaded first
+    COOKIES = [c.strip() for c in os.environ.get("TERABOX_COOKIES", "").split(",") if c.strip()]
+    # consecutive failures before an account is rested, and for how long
+    MAX_FAILURES = int(os.environ.get("ACCOUNT_MAX_FAILURES", 3))
+    COOLDOWN = int(os.environ.get("ACCOUNT_COOLDOWN", 300))
+
+class WORKER:
+    # all: receive updates and transfer files in one process (default)
+    # front: only receive updates and enqueue tasks
+    # worker: only transfer files, pulling tasks from the shared Mongo queue
+    ROLE = os.environ.get("BOT_ROLE", "all").lower()
+    # identifies this process in task leases; keep it stable across restarts
+    ID = os.environ.get("WORKER_ID") or socket.gethostname()
+    POLL_INTERVAL = int(os.environ.get("WORKER_POLL_INTERVAL", 3))
+
+class STATUS:
+    # global budget for progress message edits across all users
+    EDITS_PER_SECOND = float(os.environ.get("STATUS_EDITS_PER_SECOND", 15))
+    # minimum seconds between two edits of the same status message
+    MIN_INTERVAL = float(os.environ.get("STATUS_MIN_INTERVAL", 3))
@@ -0,0 +1,79 @@
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
+
+from config import DATABASE
+
+logger = logging.getLogger(__name__)
+
+# collection -> indexes created on startup, as (keys, options)
+INDEXES = {
+    "tasks": [
+        ([("state", ASCENDING), ("lease_until", ASCENDING)], {}),
+        ([("user_id", ASCENDING), ("seq", ASCENDING)], {}),
+        ([("user_id", ASCENDING), ("url", ASCENDING)], {}),
+        ([("expanded", ASCENDING)], {"partialFilterExpression": {"expanded": False}}),
+    ],
+    "user_locks": [
+        ([("lease_until", ASCENDING)], {}),
+    ],
+    "verifytokens": [
+        ([("token", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING)], {}),
+        # expired tokens are removed by the server
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+}
+
+
+class Database:
+    """
+    The single async MongoDB handle of the process.
+
+    The client is opened by MN_Bot.start and closed by MN_Bot.stop, so importing
+    a module never opens a connection. Modules keep a reference to the shared
+    `database` object and look collections up when they use them:
+
+        await database["tasks"].find_one({...})
+    """
+
+    def __init__(self):
+        self.client = None
+        self.db = None
+
+    async def connect(self):
+        if self.client is not None:
+            return
+        self.client = AsyncIOMotorClient(
+            DATABASE.URI,
+            maxPoolSize=DATABASE.POOL_SIZE,
+            minPoolSize=DATABASE.MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=DATABASE.TIMEOUT * 1000,
+        )
+        self.db = self.client[DATABASE.NAME]
+        await self.ensure_indexes()
+        logger.info(f"Connected to MongoDB database {DATABASE.NAME}")
+
+    async def ensure_indexes(self):
+        for name, indexes in INDEXES.items():
+            for keys, options in indexes:
+                try:
+                    await self.db[name].create_index(keys, **options)
+                except Exception as e:
+                    logger.error(f"Index creation on {name} failed: {e}")
+
+    def __getitem__(self, name: str):
+        if self.db is None:
+            raise RuntimeError("Database is not connected, call database.connect() first")
+        return self.db[name]
+
+    async def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self.db = None
+            logger.info("MongoDB connection closed")
+
+
+database = Database()
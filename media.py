@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import struct
+
+from config import MEDIA
+from metrics import MEDIA_SECONDS
+from storage import temp_storage
+
+logger = logging.getLogger(__name__)
+
+# containers that already are MP4, and the codecs an MP4 can carry as is
+MP4_FORMATS = ("mov", "mp4", "m4a", "3gp", "3g2", "mj2")
+MP4_VIDEO_CODECS = ("h264", "hevc", "av1", "mpeg4")
+MP4_AUDIO_CODECS = ("aac", "mp3", "ac3", "eac3", "opus", "alac", "flac")
+# Telegram thumbnails are JPEGs of at most 320px per side
+THUMB_SIZE = 320
+
+
+def rotation(stream: dict) -> int:
+    """Display rotation of a video stream in degrees, from its tags or side data."""
+    rotate = (stream.get("tags") or {}).get("rotate")
+    if rotate is None:
+        for side in stream.get("side_data_list") or []:
+            if "rotation" in side:
+                rotate = side["rotation"]
+                break
+    try:
+        return abs(int(float(rotate or 0))) % 360
+    except ValueError:
+        return 0
+
+
+def moov_first(path: str) -> bool:
+    """True when an MP4's index (moov) comes before its data (mdat), so it streams already."""
+    total = os.path.getsize(path)
+    pos = 0
+    with open(path, "rb") as f:
+        # every box moves pos forward by at least 8 bytes, so this ends at the file size
+        while pos + 8 <= total:
+            f.seek(pos)
+            size, kind = struct.unpack(">I4s", f.read(8))
+            if kind == b"moov":
+                return True
+            if kind == b"mdat":
+                return False
+            if size == 1:
+                # 64-bit box size follows the header
+                large = f.read(8)
+                if len(large) < 8:
+                    return False
+                size = struct.unpack(">Q", large)[0]
+                if size < 16:
+                    return False
+            elif size < 8:
+                # 0 means the box runs to the end of the file, smaller sizes are corrupt
+                return False
+            pos += size
+    return False
+
+
+class MediaProbe:
+    """
+    Prepares a downloaded video for send_video: ffprobe reads its duration and
+    size, ffmpeg grabs a thumbnail frame and, with MEDIA.FASTSTART, remuxes it
+    to an MP4 with the index in front (stream copy, no re-encoding), so
+    Telegram clients can start playing before the whole file is loaded.
+
+    At most MEDIA.CONCURRENCY ffmpeg processes run at once. Without ffmpeg on
+    PATH, or when a step fails, the video is sent the way it was downloaded.
+    """
+
+    def __init__(self, concurrency: int = MEDIA.CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self.ffprobe = shutil.which("ffprobe")
+        self.ffmpeg = shutil.which("ffmpeg")
+        self._slots = None
+        if MEDIA.PROBE and not self.available:
+            logger.warning("ffprobe/ffmpeg not found, videos are uploaded without metadata")
+
+    @property
+    def available(self) -> bool:
+        return MEDIA.PROBE and bool(self.ffprobe and self.ffmpeg)
+
+    async def _run(self, stage: str, args: list, timeout: float) -> bytes:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        async with self._slots:
+            with MEDIA_SECONDS.time(stage=stage):
+                proc = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                try:
+                    out, err = await asyncio.wait_for(proc.communicate(), timeout)
+                except BaseException:
+                    # timed out or cancelled: never leave ffmpeg running
+                    try:
+                        proc.kill()
+                    except ProcessLookupError:
+                        pass
+                    await proc.wait()
+                    raise
+        if proc.returncode != 0:
+            message = err.decode(errors="replace").strip()[-300:]
+            raise RuntimeError(f"{os.path.basename(args[0])} exited with {proc.returncode}: {message}")
+        return out
+
+    async def probe(self, path: str):
+        """Duration, display size and codecs of a video, None if it has no video stream."""
+        out = await self._run("probe", [
+            self.ffprobe, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path,
+        ], MEDIA.TIMEOUT)
+        data = json.loads(out or b"{}")
+        fmt = data.get("format") or {}
+        streams = data.get("streams") or []
+        video = next((
+            s for s in streams
+            if s.get("codec_type") == "video" and not (s.get("disposition") or {}).get("attached_pic")
+        ), None)
+        if video is None:
+            return None
+        width, height = int(video.get("width") or 0), int(video.get("height") or 0)
+        if rotation(video) in (90, 270):
+            width, height = height, width
+        try:
+            duration = float(fmt.get("duration") or video.get("duration") or 0)
+        except ValueError:
+            duration = 0.0
+        return {
+            "duration": int(round(duration)),
+            "width": width,
+            "height": height,
+            "formats": (fmt.get("format_name") or "").split(","),
+            "video_codec": video.get("codec_name", ""),
+            "audio_codecs": [s.get("codec_name", "") for s in streams if s.get("codec_type") == "audio"],
+        }
+
+    async def thumbnail(self, path: str, duration: int):
+        """JPEG frame from a tenth into the video (past black intros), next to the file."""
+        thumb = path + ".thumb.jpg"
+        at = min(duration * 0.1, 30)
+        await self._run("thumbnail", [
+            self.ffmpeg, "-v", "error", "-y", "-ss", f"{at:.2f}", "-i", path, "-frames:v", "1",
+            "-vf", f"scale={THUMB_SIZE}:{THUMB_SIZE}:force_original_aspect_ratio=decrease",
+            "-q:v", "5", thumb,
+        ], MEDIA.TIMEOUT)
+        return thumb if os.path.exists(thumb) and os.path.getsize(thumb) else None
+
+    def can_remux(self, meta: dict) -> bool:
+        return meta["video_codec"] in MP4_VIDEO_CODECS and all(c in MP4_AUDIO_CODECS for c in meta["audio_codecs"])
+
+    async def faststart(self, path: str, meta: dict):
+        """Path of a faststart MP4 copy of the video, None when it is not needed or possible."""
+        size = os.path.getsize(path)
+        if size < MEDIA.FASTSTART_MIN_SIZE or not self.can_remux(meta):
+            return None
+        is_mp4 = any(f in MP4_FORMATS for f in meta["formats"])
+        if is_mp4 and await asyncio.to_thread(moov_first, path):
+            return None
+        if not temp_storage.has_room(size):
+            logger.info(f"No disk space to remux {os.path.basename(path)}, sending it as is")
+            return None
+        out = path + ".faststart.mp4"
+        try:
+            await self._run("faststart", [
+                self.ffmpeg, "-v", "error", "-y", "-i", path, "-map", "0:v:0", "-map", "0:a?",
+                "-c", "copy", "-movflags", "+faststart", "-f", "mp4", out,
+            ], MEDIA.REMUX_TIMEOUT)
+        except BaseException:
+            self._remove(out)
+            raise
+        return out
+
+    async def prepare(self, path: str, name: str) -> dict:
+        """
+        send_video arguments for the video at `path`: duration, width, height,
+        thumb, supports_streaming and, after a remux, the new video path and
+        file name. Empty when probing is off or fails; pass the result to
+        cleanup() once the upload is done.
+        """
+        if not self.available:
+            return {}
+        try:
+            meta = await self.probe(path)
+        except Exception as e:
+            logger.warning(f"Probing {name} failed: {e}")
+            return {}
+        if meta is None:
+            return {}
+        params = {"duration": meta["duration"], "width": meta["width"], "height": meta["height"]}
+        try:
+            thumb = await self.thumbnail(path, meta["duration"])
+            if thumb:
+                params["thumb"] = thumb
+        except Exception as e:
+            logger.warning(f"Thumbnail of {name} failed: {e}")
+
+        streams = any(f in MP4_FORMATS for f in meta["formats"])
+        if MEDIA.FASTSTART:
+            try:
+                remuxed = await self.faststart(path, meta)
+            except Exception as e:
+                logger.warning(f"Faststart remux of {name} failed, sending it as is: {e}")
+                remuxed = None
+            if remuxed:
+                params["video"] = remuxed
+                params["file_name"] = os.path.splitext(name)[0] + ".mp4"
+                streams = True
+        params["supports_streaming"] = streams
+        return params
+
+    def cleanup(self, params: dict):
+        """Delete the thumbnail and remuxed copy made by prepare()."""
+        for key in ("thumb", "video"):
+            if params.get(key):
+                self._remove(params[key])
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+media_probe = MediaProbe()
@@ -0,0 +1,230 @@
+import time
+from collections import defaultdict
+
+# Small in-process metrics registry with Prometheus text output.
+# Metrics are updated from the event loop and read by the web server; updates
+# are plain dict/float operations, so they are cheap enough for hot paths as
+# long as callers batch byte counts instead of counting per chunk.
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+SPEED_BUCKETS = tuple(mb * 1024 * 1024 for mb in (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100))
+
+
+def _labels_text(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def samples(self):
+        """(suffix, label names, label values, value) rows."""
+        return []
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_labels_text(names, values)} {value:g}")
+        return lines
+
+    def snapshot(self):
+        rows = [(values, value) for _, _, values, value in self.samples()]
+        if not self.labelnames:
+            return rows[0][1] if rows else 0
+        return {",".join(map(str, values)): value for values, value in rows}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        super().__init__(name, help, labels)
+        self.values = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self.values[self._key(labels)] += amount
+
+    def samples(self):
+        return [("", self.labelnames, key, value) for key, value in dict(self.values).items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Callback(Metric):
+    """Value read from the application at scrape time: fn() returns a number or {label value(s): number}."""
+
+    def __init__(self, name: str, help: str, fn, kind: str = "gauge", labels=()):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if not isinstance(value, dict):
+            return [("", (), (), value)]
+        return [
+            ("", self.labelnames, key if isinstance(key, tuple) else (key,), v)
+            for key, v in value.items()
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., count, sum]
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        row = self.values.get(key)
+        if row is None:
+            row = self.values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+                break
+        row[-2] += 1
+        row[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        rows = []
+        for key, row in dict(self.values).items():
+            row = list(row)
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                rows.append(("_bucket", self.labelnames + ("le",), key + (f"{bound:g}",), cumulative))
+            rows.append(("_bucket", self.labelnames + ("le",), key + ("+Inf",), row[-2]))
+            rows.append(("_count", self.labelnames, key, row[-2]))
+            rows.append(("_sum", self.labelnames, key, row[-1]))
+        return rows
+
+    def snapshot(self):
+        out = {}
+        for key, row in dict(self.values).items():
+            count, total = row[-2], row[-1]
+            out[",".join(map(str, key)) or "all"] = {
+                "count": count,
+                "sum": round(total, 3),
+                "avg": round(total / count, 3) if count else 0,
+            }
+        if not self.labelnames:
+            return out.get("all", {"count": 0, "sum": 0, "avg": 0})
+        return out
+
+
+class _Timer:
+    """`with histogram.time():` observes the elapsed seconds of the block."""
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self.add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def callback(self, name: str, help: str, fn, kind: str = "gauge", labels=()) -> Callback:
+        return self.add(Callback(name, help, fn, kind, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in list(self.metrics.items())}
+
+
+registry = Registry()
+
+# ---------- shared application metrics ----------
+TASKS = registry.counter("mnbot_tasks_total", "Finished tasks by outcome", ["state"])
+TASK_SECONDS = registry.histogram("mnbot_task_seconds", "Duration of one task, resolve to upload")
+RESOLVE_SECONDS = registry.histogram("mnbot_resolve_seconds", "TeraBox API request latency", ["endpoint"])
+RESOLVE_ERRORS = registry.counter("mnbot_resolve_errors_total", "TeraBox API requests that failed after retries", ["endpoint"])
+RESOLVE_RETRIES = registry.counter("mnbot_resolve_retries_total", "Retried TeraBox API requests", ["endpoint"])
+DOWNLOAD_SECONDS = registry.histogram("mnbot_download_seconds", "Time to download one file")
+DOWNLOAD_BYTES = registry.counter("mnbot_download_bytes_total", "Bytes downloaded from TeraBox")
+DOWNLOAD_SPEED = registry.histogram("mnbot_download_speed_bytes", "Average download speed per file in bytes/s", buckets=SPEED_BUCKETS)
+DOWNLOAD_RETRIES = registry.counter("mnbot_download_retries_total", "Download retries", ["scope"])
+DOWNLOAD_ERRORS = registry.counter("mnbot_download_errors_total", "Downloads that failed after all retries")
+UPLOAD_SECONDS = registry.histogram("mnbot_upload_seconds", "Time to upload one file to Telegram", ["mode"])
+UPLOAD_BYTES = registry.counter("mnbot_upload_bytes_total", "Bytes uploaded to Telegram")
+UPLOAD_ERRORS = registry.counter("mnbot_upload_errors_total", "Uploads that failed", ["mode"])
+FLOOD_WAITS = registry.counter("mnbot_flood_waits_total", "FloodWait errors from Telegram", ["source"])
+FILE_CACHE = registry.counter("mnbot_file_cache_total", "Uploaded-file cache lookups", ["result"])
+MEDIA_SECONDS = registry.histogram("mnbot_media_seconds", "ffprobe/ffmpeg run time before an upload", ["stage"])
+
+
+def cache_stats(**caches):
+    """Callback value for TTLCache hit/miss counters: {(cache, result): count}."""
+    def collect():
+        out = {}
+        for name, cache in caches.items():
+            out[(name, "hit")] = cache.hits
+            out[(name, "miss")] = cache.misses
+        return out
+    return collect
+
+
+def hit_rates() -> dict:
+    """Hit rate of every cache reported through cache_stats callbacks."""
+    totals = defaultdict(lambda: {"hit": 0, "miss": 0})
+    for metric in list(registry.metrics.values()):
+        if metric.labelnames != ("cache", "result"):
+            continue
+        for _, _, (cache, result), value in metric.samples():
+            totals[cache][result] += value
+    return {
+        cache: round(c["hit"] / (c["hit"] + c["miss"]), 3) if c["hit"] + c["miss"] else None
+        for cache, c in totals.items()
+    }
@@ -3,26 +3,42 @@
 
 import os
 import re
+import json
+import hashlib
 import uuid
-import tempfile
 import asyncio
 import shutil
 import mimetypes
 import logging
 import time
-from collections import defaultdict
+import random
+from datetime import datetime, timedelta
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode, urlparse, parse_qs
 
 import aiohttp
-import requests  # used for some quick json endpoints if needed
-from pyrogram import Client, filters
+from pyrogram import Client, filters, raw
+from pyrogram.errors import FloodWait
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from verify_patch import IS_VERIFY, is_verified, build_verification_link, HOW_TO_VERIFY
-from pymongo import MongoClient
-from config import CHANNEL, DATABASE
+from pymongo.errors import DuplicateKeyError
+from config import CHANNEL, QUEUE, DOWNLOAD, UPLOAD, RESOLVER, WORKER, ACCOUNTS
+from cache import TTLCache
+from status import status_renderer
+from database import database
+from storage import temp_storage, StorageError
+from ratelimit import limiters
+from accounts import AccountPool
+from media import media_probe
+from metrics import (
+    registry, cache_stats, TASKS, TASK_SECONDS, RESOLVE_SECONDS, RESOLVE_ERRORS, RESOLVE_RETRIES,
+    DOWNLOAD_SECONDS, DOWNLOAD_BYTES, DOWNLOAD_SPEED, DOWNLOAD_RETRIES, DOWNLOAD_ERRORS,
+    UPLOAD_SECONDS, UPLOAD_BYTES, UPLOAD_ERRORS, FLOOD_WAITS, FILE_CACHE,
+)
 
 # ---------- Global Constants ----------
-TERABOX_REGEX = r'https?://(?:www\.)?[^/\s]*tera[^/\s]*\.[a-z]+/s/[^\s]+'
+TERABOX_REGEX = r'https?://(?:www\.)?(?:[^/\s]*tera[^/\s]*|4funbox|mirrobox|nephobox|momerybox|tibibox)\.[a-z]+/s/[^\s]+'
 
 # ---------- Logger Setup ----------
 logging.basicConfig(
@@ -54,35 +70,391 @@ def find_between(text: str, start: str, end: str) -> str:
     except Exception:
         return ""
 
-# ---------- Config & DB ----------
-mongo_client = MongoClient(DATABASE.URI)
-db = mongo_client[DATABASE.NAME]
-
-COOKIE = "ndus=Y2YqaCTteHuiU3Ud_MYU7vHoVW4DNBi0MPmg_1tQ"  # keep or use your env
+# ---------- Config ----------
+COOKIE = "ndus=Y2YqaCTteHuiU3Ud_MYU7vHoVW4DNBi0MPmg_1tQ"  # used when TERABOX_COOKIES is not set
 HEADERS = {
     "Accept": "application/json, text/plain, */*",
     "Accept-Encoding": "gzip, deflate, br",
     "Accept-Language": "en-US,en;q=0.9,hi;q=0.8",
     "Connection": "keep-alive",
     "DNT": "1",
-    "Host": "www.terabox.app",
+    "Host": urlparse(RESOLVER.BASE_URL).netloc,
     "Upgrade-Insecure-Requests": "1",
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36 Edg/135.0.0.0",
-    "Cookie": COOKIE,
 }
 DL_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-    "Cookie": COOKIE,
 }
 
+# the Cookie header is sent per request with the account a task was given
+account_pool = AccountPool(ACCOUNTS.COOKIES or [COOKIE])
+registry.callback(
+    "mnbot_account_active", "Tasks running per TeraBox account",
+    lambda: {a.name: a.active for a in account_pool.accounts}, labels=["account"],
+)
+registry.callback(
+    "mnbot_account_healthy", "1 while a TeraBox account is in rotation",
+    lambda: {a.name: int(a.healthy) for a in account_pool.accounts}, labels=["account"],
+)
+registry.callback(
+    "mnbot_account_throttled_total", "Throttled responses per TeraBox account",
+    lambda: {a.name: a.throttled for a in account_pool.accounts}, kind="counter", labels=["account"],
+)
+registry.callback(
+    "mnbot_account_bytes_total", "Bytes downloaded per TeraBox account",
+    lambda: {a.name: a.bytes for a in account_pool.accounts}, kind="counter", labels=["account"],
+)
+
+def dl_headers(account) -> dict:
+    return dict(DL_HEADERS, Cookie=account.cookie)
+
+# ---------- file_id cache ----------
+class FileCache:
+    """
+    Remembers where a TeraBox file was already uploaded, keyed by share surl,
+    fs_id, size and md5, so repeated links are served with a server-side copy
+    of that message instead of a new download and upload.
+    """
+
+    def __init__(self, collection: str):
+        self.name = collection
+
+    @property
+    def col(self):
+        return database[self.name]
+
+    @staticmethod
+    def cache_id(info: dict) -> str:
+        return f"{info.get('surl')}:{info.get('fs_id')}:{info.get('size_bytes')}:{info.get('md5', '')}"
+
+    async def get(self, client: Client, info: dict):
+        """Cached message for this file, or None. Entries whose message is gone are dropped."""
+        if not info.get("fs_id"):
+            return None
+        try:
+            entry = await self.col.find_one({"_id": self.cache_id(info)})
+        except Exception as e:
+            logger.error(f"File cache lookup failed: {e}")
+            return None
+        if not entry:
+            return None
+        try:
+            msg = await client.get_messages(entry["chat_id"], entry["message_id"])
+        except Exception:
+            msg = None
+        if not msg or msg.empty or not (msg.video or msg.document):
+            await self.invalidate(info)
+            return None
+        return msg
+
+    async def send_cached(self, client: Client, info: dict, chat_id: int) -> bool:
+        msg = await self.get(client, info)
+        if not msg:
+            return False
+        try:
+            sent = await msg.copy(chat_id)
+        except Exception as e:
+            logger.warning(f"Cached copy of {info['name']} failed, uploading again: {e}")
+            await self.invalidate(info)
+            return False
+        # same retention as a fresh upload to the user
+        schedule_user_delete(sent)
+        logger.info(f"Served {info['name']} from file cache")
+        return True
+
+    async def put(self, info: dict, msg: Message):
+        media = msg.video or msg.document
+        if not info.get("fs_id") or not media:
+            return
+        try:
+            await self.col.update_one(
+                {"_id": self.cache_id(info)},
+                {"$set": {
+                    "surl": info.get("surl"),
+                    "fs_id": info.get("fs_id"),
+                    "size": info.get("size_bytes"),
+                    "md5": info.get("md5", ""),
+                    "name": info["name"],
+                    "chat_id": msg.chat.id,
+                    "message_id": msg.id,
+                    "file_id": media.file_id,
+                    "created_at": datetime.utcnow(),
+                }},
+                upsert=True,
+            )
+        except Exception as e:
+            logger.error(f"File cache store failed: {e}")
+
+    async def invalidate(self, info: dict):
+        try:
+            await self.col.delete_one({"_id": self.cache_id(info)})
+        except Exception as e:
+            logger.error(f"File cache invalidation failed: {e}")
+
+file_cache = FileCache("file_cache")
+
+# ---------- persistent task store ----------
+class TaskStore:
+    """
+    Mongo copy of every queued task, so pending links and cooldowns survive
+    deploys and crashes. A worker claims a task with an atomic
+    find_one_and_update that sets a lease; the lease is renewed while the task
+    runs, and once it expires the task can be claimed again.
+    Task states: queued -> running -> done | failed | cancelled.
+    A per-user lock with its own lease makes sure only one process works
+    through a user's queue, which keeps per-user order and cooldown when
+    several workers share the queue.
+    """
+
+    def __init__(self, tasks_col: str, cooldowns_col: str, locks_col: str):
+        self.tasks_name = tasks_col
+        self.cooldowns_name = cooldowns_col
+        self.locks_name = locks_col
+
+    @property
+    def tasks(self):
+        return database[self.tasks_name]
+
+    @property
+    def cooldowns(self):
+        return database[self.cooldowns_name]
+
+    @property
+    def locks(self):
+        return database[self.locks_name]
+
+    async def _run(self, fn, *args, **kwargs):
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Task store error: {e}")
+            return None
+
+    @staticmethod
+    def _task_doc(user_id: int, task: dict, is_admin: bool) -> dict:
+        return {
+            "user_id": user_id,
+            "url": task["url"],
+            "info": task["info"],
+            "seq": task["seq"],
+            "is_admin": is_admin,
+            # a link still has to be enumerated; files taken from a share do not
+            "expanded": task["info"] is not None,
+            "state": "queued",
+            "worker": None,
+            "lease_until": None,
+            "created_at": datetime.utcnow(),
+        }
+
+    async def add(self, user_id: int, task: dict, is_admin: bool):
+        result = await self._run(self.tasks.insert_one, self._task_doc(user_id, task, is_admin))
+        if result is not None:
+            task["_id"] = result.inserted_id
+
+    async def add_many(self, user_id: int, tasks: list, is_admin: bool):
+        """Insert a batch of tasks in one round trip."""
+        if not tasks:
+            return
+        docs = [self._task_doc(user_id, task, is_admin) for task in tasks]
+        result = await self._run(self.tasks.insert_many, docs)
+        if result is not None:
+            for task, _id in zip(tasks, result.inserted_ids):
+                task["_id"] = _id
+
+    async def claim(self, task: dict) -> bool:
+        """Take the lease on a task. False when another worker holds it or it is finished."""
+        if "_id" not in task:
+            return True
+        now = datetime.utcnow()
+        try:
+            doc = await self.tasks.find_one_and_update(
+                {"_id": task["_id"], "$or": [
+                    {"state": "queued"},
+                    {"state": "running", "lease_until": {"$lt": now}},
+                    {"state": "running", "worker": WORKER.ID},
+                ]},
+                {"$set": {
+                    "state": "running",
+                    "worker": WORKER.ID,
+                    "lease_until": now + timedelta(seconds=QUEUE.LEASE),
+                    "started_at": now,
+                }},
+            )
+        except Exception as e:
+            logger.error(f"Task store error: {e}")
+            # store unreachable: run the task rather than drop user work
+            return True
+        if doc is None:
+            return False
+        logger.info(f"Task {task['_id']} running on {WORKER.ID}")
+        return True
+
+    async def keep_leased(self, task: dict, on_lost=None):
+        """
+        Renews the lease of a running task until cancelled. When the lease is
+        gone, calls on_lost(state) with the task's current state: "cancelled"
+        when the user cancelled it elsewhere, otherwise it was taken over or finished.
+        """
+        if "_id" not in task:
+            return
+        while True:
+            await asyncio.sleep(QUEUE.LEASE / 3)
+            result = await self._run(
+                self.tasks.update_one,
+                {"_id": task["_id"], "worker": WORKER.ID, "state": "running"},
+                {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=QUEUE.LEASE)}},
+            )
+            if result is None or result.matched_count:
+                continue
+            try:
+                doc = await self.tasks.find_one({"_id": task["_id"]}, {"state": 1})
+            except Exception as e:
+                logger.error(f"Task store error: {e}")
+                continue
+            if on_lost:
+                on_lost(doc["state"] if doc else "cancelled")
+            return
+
+    async def lock_user(self, user_id: int) -> bool:
+        """Become the only process working on a user's queue."""
+        now = datetime.utcnow()
+        try:
+            await self.locks.find_one_and_update(
+                {"_id": user_id, "$or": [{"lease_until": {"$lt": now}}, {"worker": WORKER.ID}]},
+                {"$set": {"worker": WORKER.ID, "lease_until": now + timedelta(seconds=QUEUE.LEASE)}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            # the upsert collided with a live lock held by another worker
+            return False
+        except Exception as e:
+            logger.error(f"Task store error: {e}")
+            return True
+
+    async def keep_user_locked(self, user_id: int):
+        while True:
+            await asyncio.sleep(QUEUE.LEASE / 3)
+            await self._run(
+                self.locks.update_one,
+                {"_id": user_id, "worker": WORKER.ID},
+                {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=QUEUE.LEASE)}},
+            )
+
+    async def unlock_user(self, user_id: int):
+        await self._run(self.locks.delete_one, {"_id": user_id, "worker": WORKER.ID})
+
+    async def release_worker(self):
+        """
+        Hand this worker's running tasks and user locks back on shutdown, so
+        the next process (often under a new WORKER.ID) need not wait for the leases.
+        """
+        await self._run(
+            self.tasks.update_many,
+            {"worker": WORKER.ID, "state": "running"},
+            {"$set": {"state": "queued", "worker": None, "lease_until": None}},
+        )
+        await self._run(self.locks.delete_many, {"worker": WORKER.ID})
+
+    def _claimable(self) -> dict:
+        return {"$or": [
+            {"state": "queued"},
+            {"state": "running", "lease_until": {"$lt": datetime.utcnow()}},
+        ]}
+
+    async def claimable_users(self) -> list:
+        return await self._run(self.tasks.distinct, "user_id", self._claimable()) or []
+
+    async def load_user_tasks(self, user_id: int) -> list:
+        query = {"user_id": user_id, **self._claimable()}
+        return await self._run(lambda: self.tasks.find(query).sort("seq", 1).to_list(None)) or []
+
+    async def active_urls(self, user_id: int) -> set:
+        query = {"user_id": user_id, "state": {"$in": ["queued", "running"]}}
+        return set(await self._run(self.tasks.distinct, "url", query) or [])
+
+    async def count_active(self, user_id: int) -> int:
+        query = {"user_id": user_id, "state": {"$in": ["queued", "running"]}}
+        return await self._run(self.tasks.count_documents, query) or 0
+
+    async def last_seq(self, user_id: int) -> float:
+        """Highest seq among a user's unfinished tasks, 0 when there are none."""
+        query = {"user_id": user_id, "state": {"$in": ["queued", "running"]}}
+        doc = await self._run(self.tasks.find_one, query, {"seq": 1}, sort=[("seq", -1)])
+        return doc["seq"] if doc else 0
+
+    async def queue_position(self, task: dict) -> int:
+        query = {"state": "queued", "seq": {"$lte": task["seq"]}}
+        return await self._run(self.tasks.count_documents, query) or 0
+
+    async def set_state(self, task: dict, state: str, error: str = None):
+        if "_id" not in task:
+            return
+        update = {"state": state, "lease_until": None, "finished_at": datetime.utcnow()}
+        if error:
+            update["error"] = str(error)[:500]
+        await self._run(self.tasks.update_one, {"_id": task["_id"]}, {"$set": update})
+        logger.info(f"Task {task['_id']} {state}")
+
+    async def save_info(self, task: dict):
+        if "_id" in task:
+            await self._run(self.tasks.update_one, {"_id": task["_id"]}, {"$set": {"info": task["info"]}})
+
+    async def mark_expanded(self, task: dict):
+        if "_id" in task:
+            await self._run(self.tasks.update_one, {"_id": task["_id"]}, {"$set": {"expanded": True}})
+
+    async def cancel_user(self, user_id: int):
+        await self._run(
+            self.tasks.update_many,
+            {"user_id": user_id, "state": {"$in": ["queued", "running"]}},
+            {"$set": {"state": "cancelled", "lease_until": None, "finished_at": datetime.utcnow()}},
+        )
+
+    async def known_fs_ids(self, user_id: int, url: str) -> set:
+        ids = await self._run(self.tasks.distinct, "info.fs_id", {"user_id": user_id, "url": url})
+        return set(ids or [])
+
+    async def set_cooldown(self, user_id: int, timestamp: float):
+        await self._run(
+            self.cooldowns.update_one, {"_id": user_id}, {"$set": {"last_download_time": timestamp}}, upsert=True
+        )
+
+    async def load_pending(self, worker: str = None) -> list:
+        """
+        Unfinished tasks plus finished shares whose enumeration never completed,
+        only those last run by `worker` when given.
+        """
+        query = {"$or": [
+            {"state": {"$in": ["queued", "running"]}},
+            {"expanded": False, "info": {"$ne": None}, "state": {"$ne": "cancelled"}},
+        ]}
+        if worker:
+            query["worker"] = worker
+        cursor = self.tasks.find(query).sort([("user_id", 1), ("seq", 1)])
+        return await self._run(cursor.to_list, None) or []
+
+    async def load_unexpanded(self, user_id: int) -> list:
+        """A user's shares whose enumeration never completed."""
+        query = {"user_id": user_id, "expanded": False, "info": {"$ne": None}, "state": {"$ne": "cancelled"}}
+        return await self._run(lambda: self.tasks.find(query).sort("seq", 1).to_list(None)) or []
+
+    async def load_cooldowns(self, user_ids) -> dict:
+        docs = await self._run(lambda: self.cooldowns.find({"_id": {"$in": list(user_ids)}}).to_list(None))
+        return {d["_id"]: d.get("last_download_time", 0) for d in docs or []}
+
+task_store = TaskStore("tasks", "cooldowns", "user_locks")
+
 # ---------- Queue Management System ----------
 class DownloadQueue:
-    def __init__(self):
-        # each user_id -> list of urls
+    def __init__(self, store: TaskStore, max_concurrent: int = QUEUE.MAX_CONCURRENT):
+        # persistent copy of the queues below
+        self.store = store
+        # each user_id -> list of tasks: {"url": share url, "info": file info or None, "seq": order key}
         self.queues = defaultdict(list)
         # active workers per user (0 or 1)
         self.active_tasks = defaultdict(int)
-        # last finished timestamp per user, used to enforce 30s gap
+        # last finished timestamp per user, used to enforce the cooldown gap
         self.last_download_time = defaultdict(float)
         # per-user locks for queue operations
         self.locks = defaultdict(lambda: asyncio.Lock())
@@ -90,14 +462,288 @@ class DownloadQueue:
         self.status_messages = defaultdict(list)
         # cancellation flag per user
         self.cancelled = defaultdict(bool)
+        # users whose tasks are served from the admin priority lane
+        self.priority_users = set()
+        # background folder/multi-file enumerations per user
+        self.expanders = defaultdict(list)
+        # user_id -> process_queue task
+        self.processors = {}
+        # user_id -> tasks recovered after a restart, announced once the user lock is held
+        self.resumed = defaultdict(int)
+        # share tasks this process enumerated, never resumed a second time
+        self.expansions_started = set()
+        # (user_id, seq) -> first file of a fresh link being resolved, shared by prefetch and run_task
+        self.resolving = {}
+        # user_id -> started transfers: {"task", "runner", "uploading"}
+        self.inflight = defaultdict(list)
+
+        # global scheduler: at most max_concurrent transfers across all users
+        self.max_concurrent = max(1, max_concurrent)
+        # one entry per transfer slot in use, a user appears once per running task
+        self.running = []
+        # users waiting for a slot, admin lane is always served first
+        self.lanes = {"admin": deque(), "user": deque()}
+        # user_id -> future resolved when the user is granted a slot
+        self.waiters = {}
+        # drained: running transfers finish, no new ones start until resume()
+        self.draining = False
 
-    async def add_task(self, user_id: int, is_admin: bool, url: str):
+    def lane_of(self, user_id: int) -> str:
+        return "admin" if user_id in self.priority_users else "user"
+
+    def is_priority(self, user_id: int) -> bool:
+        return user_id in self.priority_users
+
+    async def add_tasks(self, user_id: int, is_admin: bool, urls: list) -> dict:
+        """
+        Queue a batch of normalized links in one step. Links already pending
+        for the user are skipped, non-admins get as many as fit under
+        QUEUE.USER_LIMIT. Returns counts and the queue positions of the batch.
+        """
         async with self.locks[user_id]:
-            if (not is_admin) and len(self.queues[user_id]) >= 5:
-                return False, "❌ Queue limit reached (max 5). Please wait for current downloads to finish."
-            pos = len(self.queues[user_id]) + 1
-            self.queues[user_id].append(url)
-            return True, f"📥 Added to queue (Position: {pos})"
+            if is_admin:
+                self.priority_users.add(user_id)
+            else:
+                self.priority_users.discard(user_id)
+            front = WORKER.ROLE == "front"
+            if front:
+                # workers own the queue, only the shared store knows its state
+                pending = {normalize_link(u) or u for u in await self.store.active_urls(user_id)}
+                count = await self.store.count_active(user_id)
+                last_seq = await self.store.last_seq(user_id)
+            else:
+                pending = {normalize_link(t["url"]) or t["url"] for t in self.queues[user_id]}
+                count = len(self.queues[user_id])
+                last_seq = max((t["seq"] for t in self.queues[user_id]), default=0)
+
+            fresh = [u for u in urls if u not in pending]
+            accepted = fresh if is_admin else fresh[:max(0, QUEUE.USER_LIMIT - count)]
+            # links are whole steps apart and after everything queued before them;
+            # files expanded from a share take the 1e-6 steps in between
+            base = max(time.time(), last_seq + 1)
+            tasks = [{"url": url, "info": None, "seq": base + i} for i, url in enumerate(accepted)]
+            if not front:
+                self.queues[user_id].extend(tasks)
+            await self.store.add_many(user_id, tasks, is_admin)
+
+            positions = []
+            if tasks and front:
+                positions = [await self.store.queue_position(tasks[0]), await self.store.queue_position(tasks[-1])]
+            elif tasks:
+                last = len(self.pending_tasks(user_id)) - 1
+                positions = [self.position(user_id, last - len(tasks) + 1), self.position(user_id, last)]
+            return {
+                "added": len(tasks),
+                "duplicates": len(urls) - len(fresh),
+                "over_limit": len(fresh) - len(accepted),
+                "positions": positions,
+            }
+
+    async def finish_task(self, user_id: int, task: dict, state: str, error=None):
+        """Drop a task from a user's queue and record how it ended."""
+        # a cancelled queue was already cleared and stored as such
+        if task in self.queues[user_id]:
+            self.queues[user_id].remove(task)
+            TASKS.inc(state=state)
+            await self.store.set_state(task, state, error)
+
+    async def notify(self, client: Client, user_id: int, text: str):
+        try:
+            await client.send_message(user_id, text)
+        except Exception as e:
+            logger.error(f"Failed to notify {user_id}: {e}")
+
+    async def recover(self, client: Client):
+        """
+        Reload unfinished tasks after a restart and start their users' queues.
+        A worker only takes back its own tasks, run_worker claims the rest.
+        Unfinished share enumerations resume once the user lock is held.
+        """
+        docs = await self.store.load_pending(WORKER.ID if WORKER.ROLE == "worker" else None)
+        if not docs:
+            return
+        cooldowns = await self.store.load_cooldowns({d["user_id"] for d in docs})
+        by_user = defaultdict(list)
+        for doc in docs:
+            by_user[doc["user_id"]].append(doc)
+        resumed = defaultdict(int)
+        for user_id, user_docs in by_user.items():
+            # handlers are live already: a link sent during startup may be queued and stored
+            async with self.locks[user_id]:
+                known = {task.get("_id") for task in self.queues[user_id]}
+                for doc in user_docs:
+                    if doc.get("is_admin"):
+                        self.priority_users.add(user_id)
+                    if doc["state"] in ("queued", "running") and doc["_id"] not in known:
+                        self.queues[user_id].append(self.task_from(doc))
+                        resumed[user_id] += 1
+                if known:
+                    self.queues[user_id].sort(key=lambda task: task["seq"])
+        for user_id, timestamp in cooldowns.items():
+            self.last_download_time[user_id] = timestamp
+        # users with only an unfinished enumeration are started too
+        for user_id in by_user:
+            if resumed[user_id]:
+                self.resumed[user_id] = resumed[user_id]
+            self.start_user(client, user_id)
+        logger.info(f"Recovered {sum(resumed.values())} tasks for {len(resumed)} users")
+
+    @staticmethod
+    def task_from(doc: dict) -> dict:
+        return {"_id": doc["_id"], "url": doc["url"], "info": doc.get("info"), "seq": doc["seq"]}
+
+    async def resume_expansions(self, client: Client, user_id: int):
+        """
+        Continue share enumerations a stopped process left unfinished. Called
+        with the user lock held, so no live process is enumerating them.
+        """
+        if any(not t.done() for t in self.expanders.get(user_id, [])):
+            return
+        for doc in await self.store.load_unexpanded(user_id):
+            if doc["_id"] in self.expansions_started:
+                continue
+            task = next((t for t in self.queues[user_id] if t.get("_id") == doc["_id"]), None) or self.task_from(doc)
+            skip = await self.store.known_fs_ids(user_id, task["url"])
+            self.expanders[user_id].append(asyncio.create_task(
+                self.expand_share(client, user_id, task, iter_share_files(task["url"].strip()), skip)
+            ))
+
+    async def refill(self, user_id: int) -> bool:
+        """Pull a user's claimable tasks stored by other processes (front, crashed workers)."""
+        docs = await self.store.load_user_tasks(user_id)
+        known = {task.get("_id") for task in self.queues[user_id]}
+        added = False
+        for doc in docs:
+            if doc["_id"] in known:
+                continue
+            self.queues[user_id].append(self.task_from(doc))
+            if doc.get("is_admin"):
+                self.priority_users.add(user_id)
+            added = True
+        if added:
+            self.queues[user_id].sort(key=lambda task: task["seq"])
+        return added
+
+    async def run_worker(self, client: Client):
+        """
+        Keep taking users with claimable tasks from the shared queue, at most
+        max_concurrent users at a time so other workers get their share. Also
+        picks up tasks and users whose lease or lock was still held by a dead
+        process when they were first tried.
+        """
+        while True:
+            if self.draining:
+                await asyncio.sleep(WORKER.POLL_INTERVAL)
+                continue
+            try:
+                for user_id in await self.store.claimable_users():
+                    if sum(self.active_tasks.values()) >= self.max_concurrent:
+                        break
+                    self.start_user(client, user_id)
+            except Exception as e:
+                logger.error(f"Worker poll failed: {e}")
+            await asyncio.sleep(WORKER.POLL_INTERVAL)
+
+    def start_user(self, client: Client, user_id: int):
+        """Work through a user's queue unless that already happens in this process."""
+        runner = self.processors.get(user_id)
+        if self.active_tasks[user_id] > 0 or (runner and not runner.done()):
+            return
+        self.processors[user_id] = asyncio.create_task(self.process_queue(client, user_id))
+
+    async def stop(self):
+        """Stop every user's queue and hand leases and locks back for the next process."""
+        runners = [r for r in self.processors.values() if not r.done()]
+        runners += [t for tasks in self.expanders.values() for t in tasks] + list(self.resolving.values())
+        for runner in runners:
+            runner.cancel()
+        await asyncio.gather(*runners, return_exceptions=True)
+        await self.store.release_worker()
+
+    # ---------- global scheduler ----------
+    def has_free_slot(self) -> bool:
+        return not self.draining and len(self.running) < self.max_concurrent and not self.waiters
+
+    async def acquire_slot(self, user_id: int):
+        """Wait until the scheduler grants user_id a global transfer slot."""
+        if self.has_free_slot():
+            self.running.append(user_id)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters[user_id] = fut
+        self.lanes[self.lane_of(user_id)].append(user_id)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # slot was granted right before we got cancelled, hand it on
+                self.release_slot(user_id)
+            else:
+                self.waiters.pop(user_id, None)
+                for lane in self.lanes.values():
+                    if user_id in lane:
+                        lane.remove(user_id)
+            raise
+
+    def release_slot(self, user_id: int):
+        if user_id in self.running:
+            self.running.remove(user_id)
+        self._grant_slots()
+
+    def _grant_slots(self):
+        # admin lane first, then round-robin: a user re-enters at the back of
+        # its lane after every task, so users take turns one task at a time
+        while not self.draining and len(self.running) < self.max_concurrent:
+            lane = self.lanes["admin"] or self.lanes["user"]
+            if not lane:
+                return
+            uid = lane.popleft()
+            fut = self.waiters.pop(uid, None)
+            if fut is None or fut.done():
+                continue
+            self.running.append(uid)
+            fut.set_result(None)
+
+    def drain(self):
+        """Let running transfers finish but start no new ones, e.g. before a redeploy."""
+        self.draining = True
+        logger.info("Queue draining, no new transfers will start")
+
+    def resume(self):
+        self.draining = False
+        self._grant_slots()
+        logger.info("Queue resumed")
+
+    def pending_tasks(self, user_id: int) -> list:
+        """Queued tasks of a user that have not started transferring yet."""
+        started = [entry["task"] for entry in self.inflight.get(user_id, [])]
+        return [task for task in self.queues.get(user_id, []) if not any(task is s for s in started)]
+
+    def dispatch_order(self) -> list:
+        """(user_id, index into pending_tasks) in the order the scheduler will start them."""
+        order = []
+        for lane_name, lane in self.lanes.items():
+            users = list(lane)
+            users += [
+                uid for uid, items in self.queues.items()
+                if items and uid not in users and self.lane_of(uid) == lane_name
+            ]
+            pending = {uid: len(self.pending_tasks(uid)) for uid in users}
+            rnd = 0
+            while True:
+                batch = [(uid, rnd) for uid in users if rnd < pending[uid]]
+                if not batch:
+                    break
+                order.extend(batch)
+                rnd += 1
+        return order
+
+    def position(self, user_id: int, index: int = 0) -> int:
+        """1-based position of a user's pending task in the global queue."""
+        for pos, entry in enumerate(self.dispatch_order(), 1):
+            if entry == (user_id, index):
+                return pos
+        return 0
 
     async def send_status(self, client: Client, chat_id: int, text: str, with_cancel: bool = True):
         buttons = None
@@ -115,247 +761,1256 @@ class DownloadQueue:
     async def cleanup_status(self, client: Client, chat_id: int):
         msgs = list(self.status_messages.get(chat_id, []))
         for msg in msgs:
-            try:
-                await msg.delete()
-            except Exception:
-                pass
+            await self.drop_status(chat_id, msg)
         self.status_messages[chat_id] = []
 
+    async def drop_status(self, chat_id: int, msg):
+        if msg is None:
+            return
+        status_renderer.forget(msg)
+        if msg in self.status_messages[chat_id]:
+            self.status_messages[chat_id].remove(msg)
+        try:
+            await msg.delete()
+        except Exception:
+            pass
+
     def cancel_queue(self, user_id: int):
         self.cancelled[user_id] = True
+        for task in self.expanders.pop(user_id, []):
+            task.cancel()
+        for (uid, _), runner in list(self.resolving.items()):
+            if uid == user_id:
+                runner.cancel()
+
+    # ---------- per-user pipeline ----------
+    def resolve_task(self, client: Client, user_id: int, task: dict) -> asyncio.Task:
+        """
+        Starts resolving the first file of a fresh link, or joins the resolution
+        already running for it. The rest of the share is queued in the background.
+        """
+        key = (user_id, task["seq"])
+        runner = self.resolving.get(key)
+        if runner is None:
+            runner = asyncio.create_task(self._resolve(client, user_id, task))
+            self.resolving[key] = runner
+            runner.add_done_callback(lambda r: self._resolved(key, r))
+        return runner
+
+    def _resolved(self, key, runner: asyncio.Task):
+        self.resolving.pop(key, None)
+        if not runner.cancelled():
+            # run_task reports the error; a prefetch nobody awaited must not warn
+            runner.exception()
+
+    async def _resolve(self, client: Client, user_id: int, task: dict) -> dict:
+        files = iter_share_files(task["url"].strip())
+        try:
+            info = await files.__anext__()
+        except StopAsyncIteration:
+            raise ValueError("Share contains no files")
+        task["info"] = info
+        await self.store.save_info(task)
+        self.expanders[user_id].append(
+            asyncio.create_task(self.expand_share(client, user_id, task, files))
+        )
+        return info
+
+    def prefetch(self, client: Client, user_id: int):
+        """Resolve the next QUEUE.PREFETCH fresh links while earlier files transfer."""
+        for task in self.pending_tasks(user_id)[:max(0, QUEUE.PREFETCH)]:
+            if task["info"] is None:
+                self.resolve_task(client, user_id, task)
+
+    def can_start(self, user_id: int) -> bool:
+        """Whether another task of the user may start next to the ones already running."""
+        started = self.inflight[user_id]
+        if not started:
+            return True
+        if not self.is_priority(user_id) and QUEUE.COOLDOWN > 0:
+            # the cooldown is a gap between two tasks, these users stay serial
+            return False
+        limit = max(1, QUEUE.ADMIN_PARALLEL) if self.is_priority(user_id) else 1
+        downloading = sum(1 for entry in started if not entry["uploading"])
+        # one task more than the limit may run, so the next download overlaps the last upload
+        return downloading < limit and len(started) <= limit
+
+    def start_task(self, client: Client, user_id: int, task: dict):
+        """Runs a claimed task in the background; it holds the slot acquired for it until done."""
+        entry = {"task": task, "uploading": False}
+
+        def lost(state: str):
+            if state == "cancelled":
+                self.cancel_queue(user_id)
+                return
+            # another worker took the task over (or finished it): stop only this one
+            logger.warning(f"Lost the lease on task {task.get('_id')} ({state}), dropping it here")
+            if task in self.queues[user_id]:
+                self.queues[user_id].remove(task)
+            entry["runner"].cancel()
+
+        lease = asyncio.create_task(self.store.keep_leased(task, on_lost=lost))
+
+        async def run():
+            try:
+                await self.run_task(client, user_id, task, on_uploading=lambda: entry.update(uploading=True))
+            except Exception as e:
+                logger.error(f"Task {task['url']} of {user_id} failed: {e}")
+                await self.finish_task(user_id, task, "failed", e)
+            finally:
+                lease.cancel()
+                self.release_slot(user_id)
+                if entry in self.inflight[user_id]:
+                    self.inflight[user_id].remove(entry)
+
+        entry["runner"] = asyncio.create_task(run())
+        self.inflight[user_id].append(entry)
+
+    async def wait_inflight(self, user_id: int, timeout: float = 1):
+        """Waits until a started task ends; upload stage changes are picked up by the timeout."""
+        runners = [entry["runner"] for entry in self.inflight[user_id]]
+        if runners:
+            await asyncio.wait(runners, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+    # ---------- multi-file shares ----------
+    async def expand_share(self, client: Client, user_id: int, parent: dict, files, skip: set = None):
+        """
+        Queues every further file of a share as its own task while the first
+        one is already transferring. Files keep their share order, right
+        after the share they came from.
+        """
+        last = parent
+        added = 0
+        skip = skip if skip is not None else {parent["info"]["fs_id"]}
+        if "_id" in parent:
+            self.expansions_started.add(parent["_id"])
+        is_admin = self.is_priority(user_id)
+        limit = None if is_admin else QUEUE.SHARE_FILE_LIMIT
+        try:
+            async for info in files:
+                if info["fs_id"] in skip:
+                    continue
+                if limit is not None and added + len(skip) > limit:
+                    await self.notify(
+                        client, user_id, f"⚠️ Only the first {limit + 1} files of this share were queued.\n{parent['url']}"
+                    )
+                    break
+                task = {"url": parent["url"], "info": info, "seq": last["seq"] + 1e-6}
+                items = self.queues[user_id]
+                index = next((i for i, item in enumerate(items) if item is last), 0) + 1
+                items.insert(index, task)
+                await self.store.add(user_id, task, is_admin)
+                last = task
+                added += 1
+            await self.store.mark_expanded(parent)
+        except Exception as e:
+            logger.error(f"Share enumeration failed: {e}")
+            await self.notify(client, user_id, f"❌ Could not list every file of:\n{parent['url']}\n`{e}`")
+        finally:
+            await files.aclose()
+        if added:
+            logger.info(f"Queued {added} more files from {parent['url']} for {user_id}")
+
+    async def wait_expansion(self, user_id: int) -> bool:
+        """Waits briefly on running enumerations; False once none is left."""
+        running = [t for t in self.expanders.get(user_id, []) if not t.done()]
+        self.expanders[user_id] = running
+        if not running:
+            return False
+        await asyncio.wait(running, timeout=1)
+        return True
 
     def clear_cancel(self, user_id: int):
         self.cancelled[user_id] = False
 
-    async def process_queue(self, client: Client, user_id: int, is_admin: bool, trigger_message: Message):
+    async def process_queue(self, client: Client, user_id: int):
         # avoid starting multiple workers
         if self.active_tasks[user_id] > 0:
             return
 
         self.active_tasks[user_id] += 1
+        user_lock = None
         try:
-            while self.queues[user_id]:
+            # one process per user across all workers keeps order and cooldown
+            if not await self.store.lock_user(user_id):
+                # the tasks stay in the store; run_worker tries again once the lock expires
+                self.queues.pop(user_id, None)
+                return
+            user_lock = asyncio.create_task(self.store.keep_user_locked(user_id))
+            resumed = self.resumed.pop(user_id, 0)
+            if resumed:
+                await self.notify(client, user_id, f"♻️ Bot restarted, resuming {resumed} queued task(s).")
+            await self.resume_expansions(client, user_id)
+            cooldowns = await self.store.load_cooldowns([user_id])
+            self.last_download_time[user_id] = max(
+                self.last_download_time.get(user_id, 0), cooldowns.get(user_id, 0)
+            )
+            await self.refill(user_id)
+
+            while True:
                 if self.cancelled.get(user_id, False):
+                    # started tasks see the flag and stop, wait for them before clearing it
+                    await asyncio.gather(*(e["runner"] for e in self.inflight[user_id]), return_exceptions=True)
                     # clear queue and inform user
                     self.queues[user_id].clear()
-                    await trigger_message.reply("❌ Your queue was cancelled.")
+                    await self.store.cancel_user(user_id)
+                    await self.notify(client, user_id, "❌ Your queue was cancelled.")
                     self.cancelled[user_id] = False
                     await self.cleanup_status(client, user_id)
                     break
 
-                url = self.queues[user_id][0]
-                # enforce delay for non-admins (30s between tasks)
-                if not is_admin:
-                    elapsed = time.time() - self.last_download_time.get(user_id, 0)
-                    if elapsed < 30:
-                        wait = 30 - elapsed
-                        await trigger_message.reply(f"⏳ Waiting {int(wait)}s before starting next task...")
-                        await asyncio.sleep(wait)
-
-                # create a status message (we keep one active status per step)
-                info = None
-                try:
-                    info = await asyncio.to_thread(get_file_info_sync, url.strip())
-                except Exception as e:
-                    logger.error(f"Failed to fetch file info: {e}")
-                    await trigger_message.reply(f"❌ Failed to get file info for:\n{url}\n`{e}`")
-                    # remove and continue
-                    self.queues[user_id].pop(0)
+                self.prefetch(client, user_id)
+                pending = self.pending_tasks(user_id)
+                if not pending:
+                    if self.inflight[user_id]:
+                        await self.wait_inflight(user_id)
+                    elif not (await self.wait_expansion(user_id) or await self.refill(user_id)):
+                        break
+                    # transfers or share enumerations are still running, look again
                     continue
-
-                total_files = len(self.queues[user_id])
-                position = 1
-
-                status_text = (
-                    f"⬇️ Starting download ({info['name']})\n"
-                    f"📦 Position: {position}/{total_files}\n"
-                    f"💾 Size: {info['size_str']}\n"
-                    f"🔗 {url}\n\n"
-                    f"Download: 0.00 MB / {info['size_str']}\n"
-                    f"Speed: 0.00 MB/s\n"
-                    f"Upload: 0.00 MB\n"
-                    f"Upload speed: 0.00 MB/s\n"
-                )
-                status_msg = await self.send_status(client, user_id, status_text, with_cancel=True)
-                if status_msg:
-                    self.status_messages[user_id].append(status_msg)
-
-                # perform download with progress (async)
-                tmp_name = f"{uuid.uuid4().hex}_{info['name']}"
-                tmp_path = os.path.join(tempfile.gettempdir(), tmp_name)
-                try:
-                    await download_with_progress(client, status_msg, url, info, tmp_path, user_id, self)
-                except Exception as e:
-                    logger.error(f"Download error: {e}")
-                    try:
-                        await status_msg.edit_text(f"❌ Download failed for {info['name']}:\n`{e}`")
-                    except Exception:
-                        pass
-                    if os.path.exists(tmp_path):
-                        try:
-                            os.remove(tmp_path)
-                        except Exception:
-                            pass
-                    # pop and continue
-                    self.queues[user_id].pop(0)
-                    await asyncio.sleep(1)
+                if not self.can_start(user_id):
+                    await self.wait_inflight(user_id)
                     continue
 
-                # now upload to user with progress
-                try:
-                    await status_msg.edit_text(status_text + "\nUploading...")
-                except Exception:
-                    pass
+                task = pending[0]
+                # enforce cooldown between tasks for the normal lane
+                if not self.is_priority(user_id):
+                    elapsed = time.time() - self.last_download_time.get(user_id, 0)
+                    if elapsed < QUEUE.COOLDOWN:
+                        wait = QUEUE.COOLDOWN - elapsed
+                        await self.notify(client, user_id, f"⏳ Waiting {int(wait)}s before starting next task...")
+                        await asyncio.sleep(wait)
 
+                # wait for a global transfer slot
+                if not self.has_free_slot() and not self.inflight[user_id]:
+                    await self.notify(
+                        client, user_id, f"⏳ All download slots are busy. Your position in queue: {self.position(user_id)}"
+                    )
+                await self.acquire_slot(user_id)
+                started = False
                 try:
-                    await upload_with_progress(client, status_msg, tmp_path, info, trigger_message, user_id)
-                    # schedule deletion after upload via delete_later_task inside upload
-                except Exception as e:
-                    logger.error(f"Upload failed: {e}")
-                    try:
-                        await status_msg.edit_text(f"❌ Upload failed: `{e}`")
-                    except Exception:
-                        pass
-                    if os.path.exists(tmp_path):
-                        try:
-                            os.remove(tmp_path)
-                        except Exception:
-                            pass
-                    # pop and continue
-                    self.queues[user_id].pop(0)
-                    await asyncio.sleep(1)
-                    continue
-
-                # finished task
-                self.last_download_time[user_id] = time.time()
-                # remove finished item
-                if self.queues[user_id]:
-                    self.queues[user_id].pop(0)
-
-                # cleanup status messages
-                await asyncio.sleep(1)
-                await self.cleanup_status(client, user_id)
+                    if self.cancelled.get(user_id, False):
+                        continue
+                    if not await self.store.claim(task):
+                        # finished, taken over, or still leased by a dead process;
+                        # run_worker picks the last kind up again once the lease expires
+                        self.queues[user_id].remove(task)
+                        continue
+                    # the task owns the slot from here and releases it when done
+                    self.start_task(client, user_id, task)
+                    started = True
+                finally:
+                    if not started:
+                        self.release_slot(user_id)
 
             # end while
         finally:
+            runners = [entry["runner"] for entry in self.inflight[user_id]]
+            for runner in runners:
+                runner.cancel()
+            await asyncio.gather(*runners, return_exceptions=True)
             self.active_tasks[user_id] -= 1
             # ensure flags cleared
             self.cancelled[user_id] = False
             await self.cleanup_status(client, user_id)
+            if user_lock:
+                user_lock.cancel()
+                await self.store.unlock_user(user_id)
+
+    async def run_task(self, client: Client, user_id: int, task: dict, on_uploading=None):
+        if task["info"] is None:
+            # fresh link: take its first file now (prefetch may have already), queue the rest in the background
+            try:
+                await self.resolve_task(client, user_id, task)
+            except Exception as e:
+                logger.error(f"Failed to fetch file info: {e}")
+                await self.notify(client, user_id, f"❌ Failed to get file info for:\n{task['url']}\n`{e}`")
+                # remove and continue
+                await self.finish_task(user_id, task, "failed", e)
+                return
+        # one TeraBox account per task, the one that resolved the file if it is healthy
+        account = account_pool.acquire(prefer=task["info"].get("account"))
+        try:
+            await self._run_task(client, user_id, task, account, on_uploading)
+        finally:
+            account_pool.release(account)
+
+    async def _run_task(self, client: Client, user_id: int, task: dict, account, on_uploading=None):
+        url = task["url"]
+        info = task["info"]
+
+        # popular links: copy the earlier upload server-side instead of transferring again
+        if await file_cache.send_cached(client, info, user_id):
+            FILE_CACHE.inc(result="hit")
+            await self.finish_task(user_id, task, "done")
+            return
+        FILE_CACHE.inc(result="miss")
+
+        # this task has left the dispatch order, so show what is still waiting behind it
+        waiting = len(self.pending_tasks(user_id))
+
+        status_text = (
+            f"⬇️ Starting download ({info['name']})\n"
+            f"📦 Still queued: {waiting}\n"
+            f"💾 Size: {info['size_str']}\n"
+            f"🔗 {url}\n\n"
+            f"Download: 0.00 MB / {info['size_str']}\n"
+            f"Speed: 0.00 MB/s\n"
+            f"Upload: 0.00 MB\n"
+            f"Upload speed: 0.00 MB/s\n"
+        )
+        status_msg = await self.send_status(client, user_id, status_text, with_cancel=True)
+        if status_msg:
+            self.status_messages[user_id].append(status_msg)
+
+        with TASK_SECONDS.time():
+            if UPLOAD.PIPELINE and info.get("size_bytes"):
+                sent_msg = await self.transfer_pipelined(client, status_msg, status_text, url, info, user_id, account, on_uploading)
+            else:
+                sent_msg = await self.transfer_buffered(client, status_msg, status_text, url, info, user_id, account, on_uploading)
+        if not sent_msg:
+            # pop and continue; the error stays visible until the queue is done
+            await self.finish_task(user_id, task, "failed")
+            return
+        await file_cache.put(info, sent_msg)
+
+        # finished task
+        self.last_download_time[user_id] = time.time()
+        await self.store.set_cooldown(user_id, self.last_download_time[user_id])
+        # remove finished item
+        await self.finish_task(user_id, task, "done")
+
+        # only this task's status, other tasks of the user may still be running
+        await self.drop_status(user_id, status_msg)
+
+    async def transfer_buffered(self, client: Client, status_msg, status_text: str, url: str, info: dict, user_id: int, account=None, on_uploading=None):
+        """
+        Download to a temp file, then upload it. Returns the message to cache, None on failure.
+        on_uploading is called once the download is complete, so the user's next task can start.
+        """
+        # perform download with progress (async); the name is stable per user
+        # and file so a later attempt finds the partial file and its journal
+        tmp_name = f"{user_id}_{info.get('fs_id') or uuid.uuid4().hex}_{info['name']}"
+        tmp_path = temp_storage.path_for(tmp_name)
+        try:
+            await temp_storage.reserve(
+                tmp_path,
+                info.get("size_bytes") or 0,
+                on_wait=lambda: status_renderer.publish(status_msg, status_text + "\n💽 Waiting for free disk space...", CANCEL_MARKUP),
+            )
+        except StorageError as e:
+            logger.error(f"No room for {info['name']}: {e}")
+            await status_renderer.finish(status_msg, f"❌ Download failed for {info['name']}:\n`{e}`")
+            return None
+
+        try:
+            await download_with_progress(client, status_msg, url, info, tmp_path, user_id, self, account)
+        except BaseException as e:
+            # keep journaled partial files so sending the link again resumes them
+            temp_storage.release(tmp_path, delete=not DownloadJournal.exists(tmp_path))
+            if not isinstance(e, Exception):
+                raise
+            logger.error(f"Download error: {e}")
+            await status_renderer.finish(status_msg, f"❌ Download failed for {info['name']}:\n`{e}`")
+            return None
+
+        # now upload to user with progress
+        if on_uploading:
+            on_uploading()
+        status_renderer.publish(status_msg, status_text + "\nUploading...")
+
+        try:
+            with UPLOAD_SECONDS.time(mode="buffered"):
+                sent_msg, channel_msg = await upload_with_progress(client, status_msg, tmp_path, info, user_id, user_id)
+            UPLOAD_BYTES.inc(os.path.getsize(tmp_path))
+        except Exception as e:
+            UPLOAD_ERRORS.inc(mode="buffered")
+            logger.error(f"Upload failed: {e}")
+            await status_renderer.finish(status_msg, f"❌ Upload failed: `{e}`")
+            return None
+        finally:
+            # the upload is done or failed, either way the file is not needed again
+            temp_storage.release(tmp_path)
+        return channel_msg or sent_msg
 
-queue = DownloadQueue()
+    async def transfer_pipelined(self, client: Client, status_msg, status_text: str, url: str, info: dict, user_id: int, account=None, on_uploading=None):
+        """
+        Stream straight into Telegram. Returns the message to cache, None on failure.
+        A failed stream is retried once through the temp file path, which can resume.
+        """
+        try:
+            # download and upload overlap here, so this times the whole transfer
+            with UPLOAD_SECONDS.time(mode="pipelined"):
+                sent_msg = await stream_to_telegram(client, status_msg, url, info, user_id, user_id, self, account)
+            DOWNLOAD_BYTES.inc(info["size_bytes"])
+            UPLOAD_BYTES.inc(info["size_bytes"])
+        except Exception as e:
+            UPLOAD_ERRORS.inc(mode="pipelined")
+            if self.cancelled.get(user_id, False):
+                await status_renderer.finish(status_msg, f"❌ Transfer failed for {info['name']}:\n`{e}`")
+                return None
+            logger.warning(f"Pipelined transfer of {info['name']} failed, falling back to a buffered download: {e}")
+            return await self.transfer_buffered(client, status_msg, status_text, url, info, user_id, account, on_uploading)
+        channel_msg = None
+        if CHANNEL.ID:
+            copies = await copy_to_chats(sent_msg, [CHANNEL.ID])
+            channel_msg = copies[0] if copies else None
+        await copy_to_chats(sent_msg, CHANNEL.MIRRORS)
+        schedule_user_delete(sent_msg)
+        return channel_msg or sent_msg
+
+queue = DownloadQueue(task_store)
+registry.callback("mnbot_queue_depth", "Tasks waiting in this process", lambda: sum(len(q) for q in list(queue.queues.values())) - len(queue.running))
+registry.callback("mnbot_active_transfers", "Transfers running in this process", lambda: len(queue.running))
+registry.callback("mnbot_slot_waiters", "Users waiting for a download slot", lambda: len(queue.waiters))
+registry.callback("mnbot_queued_users", "Users with pending tasks", lambda: sum(1 for q in list(queue.queues.values()) if q))
 
 # ---------- Core terabox helpers ----------
-def get_file_info_sync(share_url: str) -> dict:
-    # Reuse your original implementation but keep it safe
-    resp = requests.get(share_url, headers=HEADERS, allow_redirects=True, timeout=30)
-    if resp.status_code != 200:
-        raise ValueError(f"Failed to fetch share page ({resp.status_code})")
-    final_url = resp.url
+_http_session = None
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    One pooled keep-alive session for every TeraBox metadata request, so the
+    share page and /share/list calls of all tasks reuse connections and DNS.
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=RESOLVER.CONNECTIONS,
+            limit_per_host=RESOLVER.CONNECTIONS_PER_HOST,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            headers=HEADERS,
+            # cookies come from the account passed with each request, never from the jar
+            cookie_jar=aiohttp.DummyCookieJar(),
+            timeout=aiohttp.ClientTimeout(total=RESOLVER.TIMEOUT, sock_connect=10),
+        )
+    return _http_session
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+class RetryableStatus(Exception):
+    pass
+
+# statuses that mean "slow down" rather than "broken"
+THROTTLE_STATUSES = (429, 503)
+
+async def fetch(url: str, as_json: bool = False, account=None):
+    """
+    GET through the shared session as `account` (least-loaded one by default),
+    with bounded retries and exponential backoff.
+    """
+    account = account or account_pool.pick()
+    # metric label: API path, share pages collapsed into one
+    endpoint = "share_list" if urlparse(url).path.endswith("/share/list") else "share_page"
+    limiter = limiters[endpoint]
+    for attempt in range(1, RESOLVER.RETRIES + 1):
+        try:
+            async with limiter:
+                with RESOLVE_SECONDS.time(endpoint=endpoint):
+                    async with get_http_session().get(url, allow_redirects=True, headers={"Cookie": account.cookie}) as resp:
+                        if resp.status in THROTTLE_STATUSES:
+                            limiter.throttled()
+                            account_pool.failure(account, throttled=True)
+                        if resp.status == 429 or resp.status >= 500:
+                            raise RetryableStatus(f"status {resp.status}")
+                        if resp.status != 200:
+                            RESOLVE_ERRORS.inc(endpoint=endpoint)
+                            if resp.status in (401, 403):
+                                # the cookie was refused; a 404 is just a dead link
+                                account_pool.failure(account)
+                            raise ValueError(f"Request to {urlparse(url).path} failed ({resp.status})")
+                        if as_json:
+                            body = await resp.json(content_type=None)
+                        else:
+                            body = await resp.text()
+                        limiter.ok()
+                        return body, str(resp.url)
+        except (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatus) as e:
+            if attempt == RESOLVER.RETRIES:
+                RESOLVE_ERRORS.inc(endpoint=endpoint)
+                raise ValueError(f"Request to {urlparse(url).path} failed: {e or type(e).__name__}")
+            RESOLVE_RETRIES.inc(endpoint=endpoint)
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1) + random.random() * 0.25)
+
+SHARE_LIST_URL = f"{RESOLVER.BASE_URL}/share/list"
+LIST_PAGE_SIZE = 100
+# share page tokens are tied to the API host and the account cookie, not to a share
+API_HOST = urlparse(SHARE_LIST_URL).netloc
+token_cache = TTLCache(maxsize=64, ttl=RESOLVER.TOKEN_TTL)
+# /share/list pages per (surl, dir, page, account); dlinks only work with the
+# cookie of the account that listed them
+info_cache = TTLCache(maxsize=RESOLVER.CACHE_SIZE, ttl=RESOLVER.INFO_TTL)
+registry.callback(
+    "mnbot_resolver_cache_total", "Resolver cache lookups", cache_stats(tokens=token_cache, listings=info_cache),
+    kind="counter", labels=["cache", "result"],
+)
+
+def surl_from_url(share_url: str):
+    """surl of a share link without a request: ?surl=xxx or /s/1xxx."""
+    parsed = urlparse(share_url)
+    surl = parse_qs(parsed.query).get("surl", [None])[0]
+    if surl:
+        return surl
+    match = re.search(r"/s/1([\w-]+)", parsed.path)
+    return match.group(1) if match else None
+
+async def load_share_page(share_url: str, account):
+    """Fetch the share page as `account`; returns (surl, tokens)."""
+    # the redirect target is the share page itself, so one request gives both
+    # the surl and the HTML with the auth tokens
+    html, final_url = await fetch(share_url, account=account)
 
     parsed = urlparse(final_url)
     surl = parse_qs(parsed.query).get("surl", [None])[0]
     if not surl:
         raise ValueError("Invalid share URL (missing surl)")
 
-    page = requests.get(final_url, headers=HEADERS, timeout=30)
-    html = page.text
-
-    js_token = find_between(html, 'fn%28%22', '%22%29')
-    logid = find_between(html, 'dp-logid=', '&')
-    bdstoken = find_between(html, 'bdstoken":"', '"')
-    if not all([js_token, logid, bdstoken]):
+    tokens = {
+        "js_token": find_between(html, 'fn%28%22', '%22%29'),
+        "logid": find_between(html, 'dp-logid=', '&'),
+        "bdstoken": find_between(html, 'bdstoken":"', '"'),
+    }
+    if not all(tokens.values()):
         raise ValueError("Failed to extract authentication tokens")
+    token_cache.set((API_HOST, account.name), tokens)
+    return surl, tokens
+
+async def share_surl(share_url: str, account) -> str:
+    return surl_from_url(share_url) or (await load_share_page(share_url, account))[0]
+
+# /share/list errnos: "slow down" and captcha demands, and problems of the
+# share itself (missing, deleted, expired, wrong password) that no retry fixes
+THROTTLE_ERRNOS = (-62, 31034, 400141)
+SHARE_ERRNOS = (-9, 2, 105, 115, 145)
+# the account's cookie is logged out or not accepted
+AUTH_ERRNOS = (-6, 9019)
 
+def list_errno(info: dict) -> int:
+    try:
+        return int(info.get("errno") or 0)
+    except (TypeError, ValueError):
+        return -1
+
+async def list_share(surl: str, tokens: dict, account, directory: str = None, page: int = 1) -> dict:
     params = {
         "app_id": "250528", "web": "1", "channel": "dubox",
-        "clienttype": "0", "jsToken": js_token, "dp-logid": logid,
-        "page": "1", "num": "20", "by": "name", "order": "asc",
-        "site_referer": final_url, "shorturl": surl, "root": "1,",
+        "clienttype": "0", "jsToken": tokens["js_token"], "dp-logid": tokens["logid"],
+        "page": str(page), "num": str(LIST_PAGE_SIZE), "by": "name", "order": "asc",
+        "site_referer": f"{RESOLVER.BASE_URL}/sharing/link?surl={surl}",
+        "shorturl": surl,
     }
-    info = requests.get(
-        "https://www.terabox.app/share/list?" + urlencode(params),
-        headers=HEADERS, timeout=30
-    ).json()
+    if directory:
+        params["dir"] = directory
+    else:
+        params["root"] = "1,"
+    info, _ = await fetch(SHARE_LIST_URL + "?" + urlencode(params), as_json=True, account=account)
+    if list_errno(info) in THROTTLE_ERRNOS:
+        # TeraBox reports rate limiting as an errno in a 200 response
+        limiters["share_list"].throttled()
+    return info
+
+async def resolve_listing(share_url: str, surl: str, account, directory: str = None, page: int = 1) -> list:
+    """One /share/list page as `account`, using its cached share page tokens when possible."""
+    token_key = (API_HOST, account.name)
+    tokens = token_cache.get(token_key)
+    cached_tokens = tokens is not None
+    if tokens is None:
+        _, tokens = await load_share_page(share_url, account)
 
-    if info.get("errno") or not info.get("list"):
+    info = await list_share(surl, tokens, account, directory, page)
+    errno = list_errno(info)
+    if errno and cached_tokens and errno not in THROTTLE_ERRNOS + SHARE_ERRNOS:
+        # cached tokens went stale, scrape the page once more
+        token_cache.pop(token_key)
+        _, tokens = await load_share_page(share_url, account)
+        info = await list_share(surl, tokens, account, directory, page)
+        errno = list_errno(info)
+
+    # only the account's own problems count against it, not dead links
+    if errno in THROTTLE_ERRNOS:
+        account_pool.failure(account, throttled=True)
+    elif errno in AUTH_ERRNOS:
+        account_pool.failure(account)
+    if errno or (not info.get("list") and not directory and page == 1):
         errmsg = info.get("errmsg", "Unknown error")
         raise ValueError(f"List API error: {errmsg}")
+    account_pool.success(account)
+    return info.get("list") or []
 
-    file = info["list"][0]
-    size_bytes = int(file.get("size", 0))
+async def list_page(share_url: str, surl: str, account, directory: str = None, page: int = 1, fresh: bool = False) -> list:
+    """
+    Cached /share/list page. Concurrent lookups of the same page share a
+    single request; fresh=True bypasses the cache (used to renew an expired dlink).
+    """
+    key = (surl, directory or "/", page, account.name)
+    if fresh:
+        entries = await resolve_listing(share_url, surl, account, directory, page)
+        info_cache.set(key, entries)
+        return entries
+    return await info_cache.get_or_load(key, lambda: resolve_listing(share_url, surl, account, directory, page))
+
+def build_file_info(entry: dict, surl: str, account, directory: str = None) -> dict:
+    size_bytes = int(entry.get("size", 0))
     return {
-        "name": file.get("server_filename", "download"),
-        "download_link": file.get("dlink", ""),
+        "name": entry.get("server_filename", "download"),
+        "download_link": entry.get("dlink", ""),
         "size_bytes": size_bytes,
-        "size_str": get_size(size_bytes)
+        "size_str": get_size(size_bytes),
+        "fs_id": str(entry.get("fs_id", "")),
+        "md5": entry.get("md5", ""),
+        "surl": surl,
+        # listing the file was found in, used to refresh its dlink
+        "dir": directory,
+        # account whose cookie the dlink belongs to
+        "account": account.name,
     }
 
+async def iter_share_files(share_url: str, directory: str = None, recursive: bool = True, fresh: bool = False, account=None):
+    """
+    Yields the info of every file in a share, lazily: pages of /share/list are
+    fetched as they are consumed and sub-folders are walked breadth first.
+    Listed as `account`, or the least-loaded account of the pool.
+    """
+    account = account or account_pool.pick()
+    surl = await share_surl(share_url, account)
+    dirs = deque([directory])
+    while dirs:
+        current = dirs.popleft()
+        page = 1
+        while True:
+            entries = await list_page(share_url, surl, account, current, page, fresh)
+            for entry in entries:
+                if str(entry.get("isdir", "0")) == "1":
+                    if recursive:
+                        dirs.append(entry.get("path"))
+                else:
+                    yield build_file_info(entry, surl, account, current)
+            if len(entries) < LIST_PAGE_SIZE:
+                break
+            page += 1
+
+async def get_file_info(share_url: str, fresh: bool = False, account=None) -> dict:
+    """Info of the first file in a share."""
+    async for info in iter_share_files(share_url, fresh=fresh, account=account):
+        return info
+    raise ValueError("Share contains no files")
+
 # ---------- download with progress (aiohttp) ----------
-async def download_with_progress(client: Client, status_msg, share_url: str, info: dict, dest_path: str, user_id: int, queue_obj: DownloadQueue):
+DOWNLOAD_CHUNK = 64 * 1024
+MAX_DOWNLOAD_CHUNK = 1024 * 1024
+CANCEL_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("⛔ Cancel Queue", callback_data="cancel_q")]])
+
+class DownloadStatusError(ValueError):
+    """The CDN answered a download request with an error status."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+class LinkExpiredError(DownloadStatusError):
+    """The CDN rejected the dlink, a fresh one has to be resolved."""
+
+def blame_account(account, error: BaseException):
+    """
+    Count a failed transfer against its account only when the CDN refused the
+    cookie or throttled it; timeouts, 5xx, short reads and disk errors are not the account's fault.
+    """
+    status = getattr(error, "status", None)
+    if status in (401, 403):
+        account_pool.failure(account)
+    elif status in THROTTLE_STATUSES:
+        account_pool.failure(account, throttled=True)
+
+def dlink_expiry(dlink: str) -> float:
+    """Unix time a TeraBox dlink stops working, from its dstime/expires params."""
+    params = parse_qs(urlparse(dlink).query)
+    try:
+        issued = int(params.get("dstime", [0])[0]) or time.time()
+    except ValueError:
+        issued = time.time()
+    expires = params.get("expires", ["8h"])[0].strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    try:
+        if expires[-1:] in units:
+            lifetime = int(expires[:-1]) * units[expires[-1]]
+        else:
+            lifetime = int(expires)
+    except ValueError:
+        lifetime = 8 * 3600
+    return issued + lifetime
+
+class DownloadJournal:
+    """
+    JSON sidecar next to a partial download. It records the source fs_id/size,
+    the dlink with its expiry and every byte range already on disk, so a retried
+    or restarted task continues with Range requests instead of starting over.
+    """
+
+    SUFFIX = ".journal"
+    SAVE_INTERVAL = 1
+
+    def __init__(self, dest_path: str, data: dict):
+        self.dest_path = dest_path
+        self.path = self.path_for(dest_path)
+        self.data = data
+        self._last_save = 0.0
+
+    @classmethod
+    def path_for(cls, dest_path: str) -> str:
+        return dest_path + cls.SUFFIX
+
+    @classmethod
+    def exists(cls, dest_path: str) -> bool:
+        return os.path.exists(cls.path_for(dest_path))
+
+    @classmethod
+    def open(cls, dest_path: str, share_url: str, info: dict) -> "DownloadJournal":
+        """Load the journal of a matching partial file, or start a fresh one."""
+        path = cls.path_for(dest_path)
+        data = None
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if (
+            data
+            and os.path.exists(dest_path)
+            and data.get("fs_id") == info.get("fs_id")
+            and data.get("size") == info.get("size_bytes")
+        ):
+            journal = cls(dest_path, data)
+            journal.set_link(info["download_link"])
+            logger.info(f"Resuming {dest_path} from {get_size(journal.completed_bytes())}")
+            return journal
+
+        journal = cls(dest_path, {
+            "fs_id": info.get("fs_id"),
+            "size": info.get("size_bytes"),
+            "share_url": share_url,
+            "ranges": [],
+        })
+        journal.set_link(info["download_link"])
+        journal.discard()
+        return journal
+
+    def set_link(self, dlink: str):
+        self.data["dlink"] = dlink
+        self.data["expires_at"] = dlink_expiry(dlink)
+
+    def expired(self, margin: int = 300) -> bool:
+        return time.time() + margin >= self.data.get("expires_at", 0)
+
+    def ranges(self) -> list:
+        return [tuple(r) for r in self.data["ranges"]]
+
+    def completed_bytes(self) -> int:
+        return sum(end - start + 1 for start, end in self.ranges())
+
+    def add_range(self, start: int, end: int):
+        merged = []
+        for s, e in sorted(self.ranges() + [(start, end)]):
+            if merged and s <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        self.data["ranges"] = merged
+
+    def reset(self, total: int):
+        self.data["size"] = total
+        self.data["ranges"] = []
+
+    def missing(self, total: int) -> list:
+        """Byte ranges (inclusive) not on disk yet."""
+        gaps, pos = [], 0
+        for start, end in self.ranges():
+            if start > pos:
+                gaps.append((pos, start - 1))
+            pos = max(pos, end + 1)
+        if pos < total:
+            gaps.append((pos, total - 1))
+        return gaps
+
+    def save(self, force: bool = False):
+        now = time.time()
+        if not force and now - self._last_save < self.SAVE_INTERVAL:
+            return
+        self._last_save = now
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def discard(self):
+        """Drop the journal together with the partial file."""
+        self.remove()
+        try:
+            os.remove(self.dest_path)
+        except OSError:
+            pass
+
+async def refresh_download_link(share_url: str, info: dict, journal: DownloadJournal = None, account=None):
+    """List the file's folder again (as `account`) and pick the dlink of the same fs_id."""
+    fresh = None
+    async for candidate in iter_share_files(share_url.strip(), info.get("dir"), recursive=False, fresh=True, account=account):
+        if candidate["fs_id"] == info.get("fs_id"):
+            fresh = candidate
+            break
+    if fresh is None:
+        raise ValueError("Shared file changed, cannot refresh download link")
+    info["download_link"] = fresh["download_link"]
+    info["account"] = fresh["account"]
+    if journal is not None:
+        journal.set_link(fresh["download_link"])
+        journal.save(force=True)
+    logger.info(f"Refreshed download link for {info['name']}")
+
+def report_download_progress(status_msg, share_url: str, info: dict, downloaded: int, size_bytes, speed: float, connections: int = 1):
+    dfmt = get_size(downloaded)
+    tfmt = get_size(size_bytes) if size_bytes else info.get("size_str", "Unknown")
+    perc = (downloaded / size_bytes * 100) if size_bytes else 0.0
+    pct_text = f"{perc:.2f}%" if size_bytes else "?"
+    conn_text = f" ({connections} connections)" if connections > 1 else ""
+    # handed to the background renderer, the download never waits on Telegram
+    status_renderer.publish(
+        status_msg,
+        f"⬇️ Downloading: {info['name']}\n"
+        f"📦 Size: {tfmt}\n"
+        f"📥 Downloaded: {dfmt} / {tfmt} ({pct_text})\n"
+        f"🔄 Speed: {speed/1024/1024:.2f} MB/s{conn_text}\n\n"
+        f"🔗 {share_url}\n\n"
+        f"⏳ To cancel this entire queue press the button below.",
+        CANCEL_MARKUP,
+    )
+
+async def probe_range_support(session: aiohttp.ClientSession, url: str):
+    """
+    Returns (total_size, final_url) when the server honours Range requests,
+    (None, url) otherwise. The final url skips the dlink redirect for every segment.
+    """
+    try:
+        async with limiters["cdn"], session.get(
+            url, headers={"Range": "bytes=0-0"}, timeout=aiohttp.ClientTimeout(total=30)
+        ) as resp:
+            if resp.status in (401, 403, 410):
+                raise LinkExpiredError(f"Download link rejected (status {resp.status})", resp.status)
+            if resp.status in THROTTLE_STATUSES:
+                limiters["cdn"].throttled()
+            content_range = resp.headers.get("Content-Range", "")
+            if resp.status != 206 or "/" not in content_range:
+                return None, url
+            total = content_range.rsplit("/", 1)[1]
+            return (int(total) if total.isdigit() else None), str(resp.url)
+    except LinkExpiredError:
+        raise
+    except Exception as e:
+        logger.warning(f"Range probe failed, using single stream: {e}")
+        return None, url
+
+async def iter_adaptive(content: aiohttp.StreamReader):
+    """Yields body chunks, doubling the read size while reads come back full."""
+    size = DOWNLOAD_CHUNK
+    while True:
+        chunk = await content.read(size)
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) == size and size < MAX_DOWNLOAD_CHUNK:
+            size *= 2
+
+# disk writes of all downloads run here, never on the event loop
+disk_io = ThreadPoolExecutor(max_workers=max(1, DOWNLOAD.IO_THREADS), thread_name_prefix="disk-io")
+
+def pwrite_all(fd: int, data, offset: int):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+class WriteBuffer:
+    """
+    Collects the chunks of one contiguous stream in a reusable buffer and writes
+    it with os.pwrite on the disk I/O thread once full. `offset` is the file
+    position up to which data is on disk, `position` includes buffered bytes.
+    """
+
+    def __init__(self, fd: int, offset: int, size: int = None):
+        self.fd = fd
+        self.offset = offset
+        self.buf = bytearray(size or DOWNLOAD.WRITE_BUFFER)
+        self.view = memoryview(self.buf)
+        self.used = 0
+
+    @property
+    def position(self) -> int:
+        return self.offset + self.used
+
+    async def write(self, chunk: bytes):
+        n = len(chunk)
+        if self.used + n > len(self.buf):
+            await self.flush()
+            if n > len(self.buf):
+                await self._pwrite(chunk)
+                return
+        self.view[self.used:self.used + n] = chunk
+        self.used += n
+
+    async def _pwrite(self, data):
+        write = asyncio.get_running_loop().run_in_executor(disk_io, pwrite_all, self.fd, data, self.offset)
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            # the thread cannot be interrupted; let it finish before the fd can be closed
+            await asyncio.wait({write})
+            raise
+        self.offset += len(data)
+
+    async def flush(self):
+        if self.used:
+            await self._pwrite(self.view[:self.used])
+            self.used = 0
+
+    async def close(self):
+        """Flush what is buffered; on failure `offset` still marks what reached the disk."""
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Disk write at {self.offset} failed: {e}")
+
+class SegmentedDownload:
+    """
+    Fetches one file over several HTTP Range connections into a preallocated file.
+    Each worker pulls the next segment from a shared deque and writes it through a
+    WriteBuffer at its offset; a failed segment only re-queues its missing tail.
+    Finished ranges go to the journal, and the connection count is hill-climbed
+    on the measured throughput.
+    """
+
+    ADAPT_INTERVAL = 3
+
+    def __init__(self, session: aiohttp.ClientSession, url: str, dest_path: str, total: int, journal: DownloadJournal):
+        self.session = session
+        self.url = url
+        self.dest_path = dest_path
+        self.total = total
+        self.journal = journal
+        self.segments = deque(
+            (start, min(start + DOWNLOAD.SEGMENT_SIZE, gap_end + 1) - 1)
+            for gap_start, gap_end in journal.missing(total)
+            for start in range(gap_start, gap_end + 1, DOWNLOAD.SEGMENT_SIZE)
+        )
+        self.max_connections = max(1, DOWNLOAD.CONNECTIONS)
+        self.target = max(1, min(DOWNLOAD.START_CONNECTIONS, self.max_connections))
+        self.downloaded = journal.completed_bytes()
+        self.retries = {}
+        self.workers = set()
+        # workers currently running, used to retire surplus ones
+        self.active = 0
+        self.error = None
+        self.fd = None
+        self._last_speed = None
+
+    def preallocate(self):
+        if os.path.exists(self.dest_path) and os.path.getsize(self.dest_path) == self.total:
+            return
+        with open(self.dest_path, "wb") as f:
+            try:
+                os.posix_fallocate(f.fileno(), 0, self.total)
+            except (AttributeError, OSError):
+                f.truncate(self.total)
+
+    async def _fetch(self, start: int, end: int):
+        out = WriteBuffer(self.fd, start)
+        cdn = limiters["cdn"]
+        try:
+            try:
+                async with cdn, self.session.get(
+                    self.url,
+                    headers={"Range": f"bytes={start}-{end}"},
+                    timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60),
+                ) as resp:
+                    if resp.status in (401, 403, 410):
+                        raise LinkExpiredError(f"Download link rejected (status {resp.status})", resp.status)
+                    if resp.status in THROTTLE_STATUSES:
+                        cdn.throttled()
+                    if resp.status != 206:
+                        raise DownloadStatusError(f"Range request failed (status {resp.status})", resp.status)
+                    cdn.ok()
+                    async for chunk in iter_adaptive(resp.content):
+                        left = end + 1 - out.position
+                        if len(chunk) > left:
+                            chunk = chunk[:left]
+                        await out.write(chunk)
+                        self.downloaded += len(chunk)
+                        if out.position > end:
+                            break
+            finally:
+                await out.close()
+            if out.offset <= end:
+                raise ValueError(f"Segment {start}-{end} ended early at {out.offset}")
+        except BaseException:
+            if out.offset <= end:
+                # keep what reached the disk, retry only the missing tail
+                self.segments.append((out.offset, end))
+                # buffered bytes that never got written are fetched again
+                self.downloaded -= out.used
+            raise
+        finally:
+            if out.offset > start:
+                self.journal.add_range(start, out.offset - 1)
+                self.journal.save()
+
+    async def _worker(self):
+        self.active += 1
+        try:
+            while self.segments and self.error is None:
+                if self.active > self.target:
+                    # scaled down: retire after the current segment
+                    return
+                start, end = self.segments.popleft()
+                try:
+                    await self._fetch(start, end)
+                except asyncio.CancelledError:
+                    raise
+                except LinkExpiredError as e:
+                    # no point retrying segments against a dead link
+                    self.error = e
+                    return
+                except Exception as e:
+                    tries = self.retries[end] = self.retries.get(end, 0) + 1
+                    if tries > DOWNLOAD.SEGMENT_RETRIES:
+                        self.error = e
+                        return
+                    DOWNLOAD_RETRIES.inc(scope="segment")
+                    logger.warning(f"Segment ending at {end} failed (try {tries}): {e}")
+                    await asyncio.sleep(min(2 ** tries, 30))
+        finally:
+            self.active -= 1
+
+    def _adapt(self, speed: float):
+        # grow while an extra connection still buys >10% throughput, back off on drops
+        if self._last_speed is None or speed > self._last_speed * 1.1:
+            self.target = min(self.target + 1, self.max_connections)
+        elif speed < self._last_speed * 0.7 and self.target > 1:
+            self.target -= 1
+        self._last_speed = speed
+
+    async def run(self, on_progress, is_cancelled):
+        self.preallocate()
+        self.fd = os.open(self.dest_path, os.O_WRONLY)
+        last_report = last_adapt = time.time()
+        last_downloaded = adapt_downloaded = self.downloaded
+        try:
+            while True:
+                self.workers = {t for t in self.workers if not t.done()}
+                if self.error is not None:
+                    raise self.error
+                if not self.segments and not self.workers:
+                    break
+                while self.segments and len(self.workers) < self.target:
+                    self.workers.add(asyncio.create_task(self._worker()))
+                await asyncio.wait(self.workers, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+
+                if is_cancelled():
+                    raise asyncio.CancelledError("Queue cancelled by user")
+                now = time.time()
+                if now - last_report >= 1:
+                    speed = (self.downloaded - last_downloaded) / (now - last_report)
+                    last_report, last_downloaded = now, self.downloaded
+                    on_progress(self.downloaded, self.total, speed, len(self.workers))
+                if now - last_adapt >= self.ADAPT_INTERVAL:
+                    self._adapt((self.downloaded - adapt_downloaded) / (now - last_adapt))
+                    last_adapt, adapt_downloaded = now, self.downloaded
+        finally:
+            for task in self.workers:
+                task.cancel()
+            await asyncio.gather(*self.workers, return_exceptions=True)
+            os.close(self.fd)
+            self.journal.save(force=True)
+        if self.journal.missing(self.total):
+            raise ValueError(f"Incomplete download ({self.journal.completed_bytes()}/{self.total} bytes)")
+
+async def download_with_progress(client: Client, status_msg, share_url: str, info: dict, dest_path: str, user_id: int, queue_obj: DownloadQueue, account=None):
     """
     Downloads file via aiohttp, updates status_msg periodically with speed and progress.
-    Checks queue_obj.cancelled[user_id] to allow cancelling mid-download.
+    Uses parallel Range segments when the server supports them, a single stream otherwise.
+    Transient failures are retried in place, resuming from the journal and refreshing
+    an expired dlink. Checks queue_obj.cancelled[user_id] to allow cancelling mid-download.
+    Downloads as `account`, defaulting to the one that resolved the dlink.
     """
+    account = account or account_pool.get(info.get("account")) or account_pool.pick()
+    journal = DownloadJournal.open(dest_path, share_url, info)
+    if info.get("account") != account.name:
+        # the dlink was listed by another account, it needs one of our own
+        journal.data["expires_at"] = 0
+    is_cancelled = lambda: queue_obj.cancelled.get(user_id, False)
+
+    # bytes are counted from the once-a-second progress reports, not per chunk
+    counted = {"bytes": 0}
+
+    def on_progress(downloaded, size_bytes, speed, connections=1):
+        if downloaded > counted["bytes"]:
+            DOWNLOAD_BYTES.inc(downloaded - counted["bytes"])
+        counted["bytes"] = downloaded
+        report_download_progress(status_msg, share_url, info, downloaded, size_bytes, speed, connections)
+
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            if journal.expired():
+                await refresh_download_link(share_url, info, journal, account)
+            counted["bytes"] = journal.completed_bytes()
+            await download_once(info, dest_path, journal, on_progress, is_cancelled, account)
+            journal.remove()
+            size = os.path.getsize(dest_path)
+            if size > counted["bytes"]:
+                DOWNLOAD_BYTES.inc(size - counted["bytes"])
+            account_pool.success(account)
+            account.bytes += size
+            elapsed = time.monotonic() - start
+            DOWNLOAD_SECONDS.observe(elapsed)
+            DOWNLOAD_SPEED.observe(size / (elapsed + 1e-9))
+            return dest_path
+        except asyncio.CancelledError:
+            if is_cancelled():
+                journal.discard()
+            raise
+        except Exception as e:
+            blame_account(account, e)
+            if attempt >= DOWNLOAD.RETRIES:
+                DOWNLOAD_ERRORS.inc()
+                raise
+            DOWNLOAD_RETRIES.inc(scope="file")
+            if isinstance(e, LinkExpiredError):
+                journal.data["expires_at"] = 0
+            logger.warning(f"Download attempt {attempt} for {info['name']} failed, resuming: {e}")
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+async def download_once(info: dict, dest_path: str, journal: DownloadJournal, on_progress, is_cancelled, account):
     url = info["download_link"]
-    chunk_size = 64 * 1024
-    start = time.time()
-    downloaded = 0
-    last_report = start
-    last_downloaded = 0
+    async with aiohttp.ClientSession(headers=dl_headers(account)) as session:
+        total, final_url = (None, url)
+        if DOWNLOAD.CONNECTIONS > 1:
+            total, final_url = await probe_range_support(session, url)
+        if total and total > DOWNLOAD.SEGMENT_SIZE:
+            if total != journal.data.get("size"):
+                journal.discard()
+                journal.reset(total)
+            download = SegmentedDownload(session, final_url, dest_path, total, journal)
+            await download.run(on_progress, is_cancelled)
+        else:
+            # no Range support, so nothing on disk can be reused
+            journal.discard()
+            journal.reset(info.get("size_bytes", 0))
+            await download_single_stream(session, final_url, info, dest_path, on_progress, is_cancelled)
+
+async def download_single_stream(session: aiohttp.ClientSession, url: str, info: dict, dest_path: str, on_progress, is_cancelled):
+    """
+    Fallback for servers that ignore Range: one sequential stream from byte zero.
+    The read loop only buffers and counts bytes; progress and cancellation are
+    checked once a second by the caller loop, like SegmentedDownload.run.
+    """
     size_bytes = info.get("size_bytes", 0) or None
 
-    async with aiohttp.ClientSession(headers=DL_HEADERS) as session:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=None)) as resp:
-            if resp.status >= 400:
-                raise ValueError(f"Download request failed (status {resp.status})")
-            # prefer Content-Length header if available
-            content_length = resp.headers.get("Content-Length")
-            if content_length is not None:
-                try:
-                    size_bytes = int(content_length)
-                except Exception:
-                    pass
-
-            with open(dest_path, "wb") as f:
-                while True:
-                    if queue_obj.cancelled.get(user_id, False):
-                        # cancel and cleanup
-                        raise asyncio.CancelledError("Queue cancelled by user")
-                    chunk = await resp.content.read(chunk_size)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-                    downloaded += len(chunk)
-
-                    now = time.time()
-                    # report every 1 second or on completion
-                    if now - last_report >= 1 or (size_bytes and downloaded >= size_bytes):
-                        speed = (downloaded - last_downloaded) / (now - last_report + 1e-9)
-                        last_report = now
-                        last_downloaded = downloaded
-                        # build progress text
-                        dfmt = get_size(downloaded)
-                        tfmt = get_size(size_bytes) if size_bytes else info.get("size_str", "Unknown")
-                        perc = (downloaded / size_bytes * 100) if size_bytes else 0.0
-                        try:
-                            pct_text = f"{perc:.2f}%" if size_bytes else "?"
-                            await status_msg.edit_text(
-                                f"⬇️ Downloading: {info['name']}\n"
-                                f"📦 Size: {tfmt}\n"
-                                f"📥 Downloaded: {dfmt} / {tfmt} ({pct_text})\n"
-                                f"🔄 Speed: {speed/1024/1024:.2f} MB/s\n\n"
-                                f"🔗 {share_url}\n\n"
-                                f"⏳ To cancel this entire queue press the button below.",
-                                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⛔ Cancel Queue", callback_data="cancel_q")]])
-                            )
-                        except Exception:
-                            # ignore edit errors
-                            pass
-    return dest_path
+    async with limiters["cdn"], session.get(url, timeout=aiohttp.ClientTimeout(total=None)) as resp:
+        if resp.status in (401, 403, 410):
+            raise LinkExpiredError(f"Download link rejected (status {resp.status})", resp.status)
+        if resp.status in THROTTLE_STATUSES:
+            limiters["cdn"].throttled()
+        if resp.status >= 400:
+            raise DownloadStatusError(f"Download request failed (status {resp.status})", resp.status)
+        # prefer Content-Length header if available
+        content_length = resp.headers.get("Content-Length")
+        if content_length is not None:
+            try:
+                size_bytes = int(content_length)
+            except Exception:
+                pass
+
+        fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        out = WriteBuffer(fd, 0)
+
+        async def pump():
+            async for chunk in iter_adaptive(resp.content):
+                await out.write(chunk)
+            await out.flush()
+
+        reader = asyncio.create_task(pump())
+        last_report = time.time()
+        last_downloaded = 0
+        try:
+            while not reader.done():
+                await asyncio.wait({reader}, timeout=1)
+                if is_cancelled():
+                    raise asyncio.CancelledError("Queue cancelled by user")
+                now = time.time()
+                speed = (out.position - last_downloaded) / (now - last_report + 1e-9)
+                last_report, last_downloaded = now, out.position
+                on_progress(out.position, size_bytes, speed)
+            reader.result()
+        finally:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+            os.close(fd)
+
+# ---------- upload once, copy everywhere else ----------
+USER_FILE_TTL = 12 * 3600
+
+async def delete_later_task(msg: Message, delay: int = USER_FILE_TTL):
+    """Deletes the user's copy of a file after `delay` seconds; the channel copy stays."""
+    await asyncio.sleep(delay)
+    try:
+        await msg.delete()
+    except Exception as e:
+        logger.warning(f"Scheduled delete of message {msg.id} in {msg.chat.id} failed: {e}")
+
+def schedule_user_delete(msg: Message):
+    if msg:
+        asyncio.create_task(delete_later_task(msg))
+
+async def send_media_file(client: Client, chat_id: int, file_path: str, info: dict, progress=None, media: dict = None) -> Message:
+    """media: send_video arguments from media_probe.prepare(), may replace the video and its name."""
+    caption = f"{info['name']}\n{info['size_str']}"
+    if is_video(info["name"]):
+        params = dict(media or {})
+        video = params.pop("video", file_path)
+        file_name = params.pop("file_name", info['name'])
+        return await client.send_video(
+            chat_id=chat_id, video=video, caption=caption, file_name=file_name, progress=progress, **params
+        )
+    return await client.send_document(
+        chat_id=chat_id, document=file_path, caption=caption, file_name=info['name'], progress=progress
+    )
+
+async def copy_to_chats(msg: Message, chat_ids) -> list:
+    """Server-side copies of an uploaded message, no bytes are sent again."""
+    copies = []
+    for chat_id in chat_ids:
+        try:
+            copies.append(await msg.copy(chat_id))
+        except Exception as e:
+            logger.error(f"Copy to {chat_id} failed: {e}")
+    return copies
 
 # ---------- upload with progress (pyrogram progress callback) ----------
-async def upload_with_progress(client: Client, status_msg, file_path: str, info: dict, trigger_message: Message, user_id: int):
+async def upload_with_progress(client: Client, status_msg, file_path: str, info: dict, chat_id: int, user_id: int):
     total = os.path.getsize(file_path)
     start = time.time()
     state = {"uploaded": 0, "last_time": start, "last_uploaded": 0}
@@ -369,54 +2024,276 @@ async def upload_with_progress(client: Client, status_msg, file_path: str, info:
         speed = (uploaded - state["last_uploaded"]) / (elapsed + 1e-9)
         state["last_time"] = now
         state["last_uploaded"] = uploaded
-        try:
-            pct = uploaded / total_bytes * 100 if total_bytes else 0
-            await status_msg.edit_text(
-                f"⬆️ Uploading: {info['name']}\n"
-                f"📥 Uploaded: {get_size(uploaded)} / {get_size(total_bytes)} ({pct:.2f}%)\n"
-                f"🔄 Upload speed: {speed/1024/1024:.2f} MB/s\n\n"
-                f"⏳ Remaining files: {len(queue.queues[user_id]) - 1}"
-            )
-        except Exception:
-            pass
+        pct = uploaded / total_bytes * 100 if total_bytes else 0
+        status_renderer.publish(
+            status_msg,
+            f"⬆️ Uploading: {info['name']}\n"
+            f"📥 Uploaded: {get_size(uploaded)} / {get_size(total_bytes)} ({pct:.2f}%)\n"
+            f"🔄 Upload speed: {speed/1024/1024:.2f} MB/s\n\n"
+            f"⏳ Remaining files: {len(queue.queues[user_id]) - 1}"
+        )
+
+    # duration, size and thumbnail let Telegram clients stream the video right away
+    media = {}
+    if is_video(info["name"]) and media_probe.available:
+        status_renderer.publish(status_msg, f"🎞 Preparing video: {info['name']}")
+        media = await media_probe.prepare(file_path, info["name"])
 
-    # send to channel first if configured
-    sent_msg = None
-    if getattr(CHANNEL, "ID", None):
+    # upload once: to the channel when configured (the copy that is kept),
+    # otherwise straight to the user; every other destination gets a server-side copy
+    user_chat = chat_id
+    first_chat = CHANNEL.ID or user_chat
+    try:
         try:
-            if is_video(info["name"]):
-                await client.send_video(chat_id=CHANNEL.ID, video=file_path, caption=f"{info['name']}\n{info['size_str']}")
-            else:
-                await client.send_document(chat_id=CHANNEL.ID, document=file_path, caption=f"{info['name']}\n{info['size_str']}")
+            uploaded = await send_media_file(client, first_chat, file_path, info, progress_callback, media)
         except Exception as e:
-            logger.error(f"Channel forward failed: {e}")
+            if first_chat == user_chat:
+                raise
+            logger.error(f"Channel upload failed, uploading to user: {e}")
+            first_chat = user_chat
+            uploaded = await send_media_file(client, first_chat, file_path, info, progress_callback, media)
+    finally:
+        media_probe.cleanup(media)
 
-    # now actual user upload with progress callback
-    if is_video(info["name"]):
-        sent_msg = await client.send_video(
-            chat_id=trigger_message.chat.id,
-            video=file_path,
-            caption=f"{info['name']}\n{info['size_str']}",
-            file_name=info['name'],
-            progress=progress_callback
-        )
+    channel_msg = uploaded if first_chat != user_chat else None
+    sent_msg = uploaded if channel_msg is None else await uploaded.copy(user_chat)
+    await copy_to_chats(uploaded, CHANNEL.MIRRORS)
+
+    schedule_user_delete(sent_msg)
+    return sent_msg, channel_msg
+
+# ---------- pipelined download -> upload (no temp file) ----------
+UPLOAD_PART_SIZE = 512 * 1024
+SMALL_FILE_LIMIT = 10 * 1024 * 1024
+
+async def parse_sent_message(client: Client, updates) -> Message:
+    """Turn the raw result of messages.SendMedia into a pyrogram Message."""
+    users = {u.id: u for u in updates.users}
+    chats = {c.id: c for c in updates.chats}
+    for update in updates.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await Message._parse(client, update.message, users, chats)
+    raise ValueError("Telegram did not return the sent message")
+
+async def stream_to_telegram(client: Client, status_msg, share_url: str, info: dict, chat_id: int, user_id: int, queue_obj: DownloadQueue, account=None) -> Message:
+    """
+    Streams the TeraBox dlink straight into Telegram upload parts.
+    The HTTP reader cuts the body into 512 KiB parts and pushes them into a
+    bounded queue (the in-memory ring buffer); UPLOAD.PIPELINE_WORKERS uploaders
+    drain it with the same SaveFilePart/SaveBigFilePart calls save_file uses.
+    Nothing touches the disk and memory stays at the buffer size.
+    """
+    account = account or account_pool.get(info.get("account")) or account_pool.pick()
+    if info.get("account") != account.name or dlink_expiry(info["download_link"]) <= time.time() + 300:
+        await refresh_download_link(share_url, info, account=account)
+    size = info["size_bytes"]
+    total_parts = max(1, -(-size // UPLOAD_PART_SIZE))
+    is_big = size > SMALL_FILE_LIMIT
+    file_id = client.rnd_id()
+    md5 = None if is_big else hashlib.md5()
+    parts = asyncio.Queue(maxsize=max(2, UPLOAD.PIPELINE_BUFFER // UPLOAD_PART_SIZE))
+    workers = max(1, UPLOAD.PIPELINE_WORKERS)
+    state = {"downloaded": 0, "uploaded": 0}
+    is_cancelled = lambda: queue_obj.cancelled.get(user_id, False)
+
+    async def read_parts():
+        index = 0
+        buf = bytearray()
+
+        async def push(data: bytes):
+            nonlocal index
+            if md5 is not None:
+                md5.update(data)
+            await parts.put((index, data))
+            index += 1
+
+        async with aiohttp.ClientSession(headers=dl_headers(account)) as session:
+            for attempt in (1, 2):
+                try:
+                    async with limiters["cdn"], session.get(
+                        info["download_link"], timeout=aiohttp.ClientTimeout(total=None, sock_read=60)
+                    ) as resp:
+                        if resp.status in (401, 403, 410):
+                            raise LinkExpiredError(f"Download link rejected (status {resp.status})", resp.status)
+                        if resp.status in THROTTLE_STATUSES:
+                            limiters["cdn"].throttled()
+                        if resp.status >= 400:
+                            raise DownloadStatusError(f"Download request failed (status {resp.status})", resp.status)
+                        async for chunk in iter_adaptive(resp.content):
+                            if is_cancelled():
+                                raise asyncio.CancelledError("Queue cancelled by user")
+                            buf += chunk
+                            state["downloaded"] += len(chunk)
+                            while len(buf) >= UPLOAD_PART_SIZE:
+                                await push(bytes(buf[:UPLOAD_PART_SIZE]))
+                                del buf[:UPLOAD_PART_SIZE]
+                    break
+                except (ValueError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    # once parts are handed to the uploaders the stream cannot restart
+                    if index or attempt == 2:
+                        raise
+                    logger.warning(f"Stream of {info['name']} failed before the first part, retrying: {e}")
+                    buf.clear()
+                    state["downloaded"] = 0
+                    if isinstance(e, LinkExpiredError):
+                        await refresh_download_link(share_url, info, account=account)
+                    else:
+                        await asyncio.sleep(1)
+        if buf:
+            await push(bytes(buf))
+        if index != total_parts:
+            raise ValueError(f"Size mismatch: got {state['downloaded']} of {size} bytes")
+        for _ in range(workers):
+            await parts.put(None)
+
+    async def upload_parts():
+        while True:
+            item = await parts.get()
+            if item is None:
+                return
+            index, data = item
+            if is_big:
+                rpc = raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id, file_part=index, file_total_parts=total_parts, bytes=data
+                )
+            else:
+                rpc = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=index, bytes=data)
+            attempt = 0
+            while True:
+                try:
+                    await client.invoke(rpc)
+                    break
+                except FloodWait as e:
+                    # waiting out a FloodWait is not a failed attempt
+                    FLOOD_WAITS.inc(source="upload")
+                    await asyncio.sleep(e.value)
+                except Exception:
+                    attempt += 1
+                    if attempt == 3:
+                        raise
+                    await asyncio.sleep(attempt)
+            state["uploaded"] += len(data)
+
+    async def report():
+        last = dict(state, time=time.time())
+        while True:
+            await asyncio.sleep(1)
+            now = time.time()
+            elapsed = now - last["time"] + 1e-9
+            dl_speed = (state["downloaded"] - last["downloaded"]) / elapsed
+            ul_speed = (state["uploaded"] - last["uploaded"]) / elapsed
+            last = dict(state, time=now)
+            status_renderer.publish(
+                status_msg,
+                f"🔀 Streaming: {info['name']}\n"
+                f"📦 Size: {info['size_str']}\n"
+                f"📥 Downloaded: {get_size(state['downloaded'])} ({dl_speed/1024/1024:.2f} MB/s)\n"
+                f"📤 Uploaded: {get_size(state['uploaded'])} ({ul_speed/1024/1024:.2f} MB/s)\n\n"
+                f"🔗 {share_url}\n\n"
+                f"⏳ To cancel this entire queue press the button below.",
+                CANCEL_MARKUP,
+            )
+
+    reader = asyncio.create_task(read_parts())
+    uploaders = [asyncio.create_task(upload_parts()) for _ in range(workers)]
+    reporter = asyncio.create_task(report())
+    tasks = [reader, *uploaders, reporter]
+    try:
+        pending = {reader, *uploaders}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # re-raises the first failure or the user's cancellation
+                task.result()
+    except Exception:
+        if reader.done() and not reader.cancelled() and reader.exception() is not None:
+            blame_account(account, reader.exception())
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    account_pool.success(account)
+    account.bytes += state["downloaded"]
+
+    name = info["name"]
+    if is_big:
+        input_file = raw.types.InputFileBig(id=file_id, parts=total_parts, name=name)
     else:
-        sent_msg = await client.send_document(
-            chat_id=trigger_message.chat.id,
-            document=file_path,
-            caption=f"{info['name']}\n{info['size_str']}",
-            file_name=info['name'],
-            progress=progress_callback
+        input_file = raw.types.InputFile(id=file_id, parts=total_parts, name=name, md5_checksum=md5.hexdigest())
+    attributes = [raw.types.DocumentAttributeFilename(file_name=name)]
+    if is_video(name):
+        attributes.insert(0, raw.types.DocumentAttributeVideo(duration=0, w=0, h=0, supports_streaming=True))
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=mimetypes.guess_type(name)[0] or "application/octet-stream",
+        file=input_file,
+        attributes=attributes,
+    )
+    updates = await client.invoke(
+        raw.functions.messages.SendMedia(
+            peer=await client.resolve_peer(chat_id),
+            media=media,
+            message=f"{name}\n{info['size_str']}",
+            random_id=client.rnd_id(),
         )
-
-    # schedule deletion of file/message after 12 hours
-    asyncio.create_task(delete_later_task(sent_msg, file_path, delay=43200))
+    )
+    return await parse_sent_message(client, updates)
 
 # ---------- admin check ----------
 def is_admin(user_id: int) -> bool:
     """Check if user is owner (admin bypass)"""
     return OWNER_ID and str(user_id) == str(OWNER_ID)
 
+# ---------- link intake ----------
+TERABOX_PATTERN = re.compile(TERABOX_REGEX)
+SHARE_CODE = re.compile(r"/s/([\w-]+)")
+# punctuation from the surrounding text that the link pattern swallows
+LINK_TRAILING = ".,;:!?)]}>'\""
+# query params that select the share; anything else is tracking
+SHARE_PARAMS = ("pwd",)
+
+def normalize_link(url: str):
+    """
+    Canonical share link: every TeraBox domain alias mapped to RESOLVER.BASE_URL
+    and tracking params dropped, so the same share always gives the same string.
+    None when the link has no share code.
+    """
+    parsed = urlparse(url.rstrip(LINK_TRAILING))
+    match = SHARE_CODE.match(parsed.path)
+    if not match:
+        return None
+    params = {k: v[0] for k, v in parse_qs(parsed.query).items() if k in SHARE_PARAMS}
+    link = f"{RESOLVER.BASE_URL}/s/{match.group(1)}"
+    return f"{link}?{urlencode(params)}" if params else link
+
+def extract_links(text: str):
+    """Normalized links of a message in order, without repeats; plus how many repeats were dropped."""
+    links = {}
+    repeated = 0
+    for raw_link in TERABOX_PATTERN.findall(text):
+        link = normalize_link(raw_link)
+        if not link:
+            continue
+        if link in links:
+            repeated += 1
+        links[link] = None
+    return list(links), repeated
+
+def intake_summary(result: dict) -> str:
+    lines = []
+    if result["added"]:
+        first, last = result["positions"]
+        where = f"position {first}" if first == last else f"positions {first}-{last}"
+        lines.append(f"📥 Added {result['added']} link(s) to the queue ({where})")
+    if result["duplicates"]:
+        lines.append(f"♻️ Skipped {result['duplicates']} duplicate link(s)")
+    if result["over_limit"]:
+        lines.append(
+            f"❌ {result['over_limit']} link(s) not added: queue limit reached (max {QUEUE.USER_LIMIT}). "
+            f"Please wait for current downloads to finish."
+        )
+    return "\n".join(lines)
+
 # ---------- message handler ----------
 @Client.on_message(filters.private)
 async def handle_terabox(client: Client, message: Message):
@@ -427,14 +2304,8 @@ async def handle_terabox(client: Client, message: Message):
         await message.reply("❌ Please send a message containing one or more TeraBox links.")
         return
 
-    try:
-        matches = re.findall(TERABOX_REGEX, text)
-    except Exception as e:
-        logger.error(f"Regex matching failed: {e}")
-        await message.reply("❌ Error processing your links. Please try again.")
-        return
-
-    if not matches:
+    links, repeated = extract_links(text)
+    if not links:
         await message.reply("❌ No valid TeraBox links found in your message.")
         return
 
@@ -452,15 +2323,13 @@ async def handle_terabox(client: Client, message: Message):
         )
         return
 
-    admin_status = is_admin(user_id)
-
-    # add each url as a task
-    for url in matches:
-        success, reply = await queue.add_task(user_id, admin_status, url)
-        await message.reply(reply)
+    result = await queue.add_tasks(user_id, is_admin(user_id), links)
+    result["duplicates"] += repeated
+    await message.reply(intake_summary(result))
 
-    # start worker if not running
-    asyncio.create_task(queue.process_queue(client, user_id, admin_status, message))
+    # start worker if not running; in split mode the worker processes pick it up
+    if result["added"] and WORKER.ROLE != "front":
+        queue.start_user(client, user_id)
 
 # ---------- callback handler (Cancel Queue) ----------
 @Client.on_callback_query()
@@ -470,6 +2339,7 @@ async def callback_handler(client, callback_query):
     if callback_query.data == "cancel_q":
         # mark cancellation
         queue.cancel_queue(user_id)
+        await queue.store.cancel_user(user_id)
         await callback_query.answer("Cancelling your queue...", show_alert=False)
         try:
             await callback_query.message.edit_text("⛔ Queue cancellation requested. Stopping tasks...")
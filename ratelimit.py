@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+
+from config import LIMITS
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """
+    Token bucket plus concurrency budget for one TeraBox endpoint.
+
+        async with limiter:
+            ...request...
+
+    waits for a free slot (at most `concurrency` requests in flight) and a
+    token (`rate` requests per second, bursts up to `burst`). The rate adapts
+    AIMD style: throttled() halves it when the server pushes back (429,
+    errno), ok() adds back a twentieth of the ceiling per successful request,
+    so the bot settles just under the rate the endpoint tolerates.
+    """
+
+    def __init__(self, name: str, rate: float, concurrency: int, burst: float = None, min_rate: float = None):
+        self.name = name
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate or max(rate / 20, 0.1)
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.throttle_events = 0
+        self._slots = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        await self._slots.acquire()
+        try:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+        except BaseException:
+            self._slots.release()
+            raise
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+        return False
+
+    def throttled(self):
+        """The endpoint pushed back: halve the rate and drop saved-up burst."""
+        self._refill()
+        old = self.rate
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = min(self.tokens, 0)
+        self.throttle_events += 1
+        logger.warning(f"{self.name} throttled, rate {old:.2f} -> {self.rate:.2f} req/s")
+
+    def ok(self):
+        if self.rate < self.max_rate:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+limiters = {
+    "share_page": AdaptiveLimiter("share_page", LIMITS.SHARE_PAGE_RATE, LIMITS.SHARE_PAGE_CONCURRENCY),
+    "share_list": AdaptiveLimiter("share_list", LIMITS.SHARE_LIST_RATE, LIMITS.SHARE_LIST_CONCURRENCY),
+    # every Range segment / stream against the dlink CDN holds one slot while it runs
+    "cdn": AdaptiveLimiter("cdn", LIMITS.CDN_RATE, LIMITS.CDN_CONCURRENCY),
+}
+
+registry.callback(
+    "mnbot_rate_limit", "Current allowed request rate per endpoint",
+    lambda: {name: l.rate for name, l in limiters.items()}, labels=["endpoint"],
+)
+registry.callback(
+    "mnbot_rate_limit_in_flight", "Requests in flight per endpoint",
+    lambda: {name: l.in_flight for name, l in limiters.items()}, labels=["endpoint"],
+)
+registry.callback(
+    "mnbot_rate_limit_throttled_total", "Times an endpoint pushed back and its rate was cut",
+    lambda: {name: l.throttle_events for name, l in limiters.items()}, kind="counter", labels=["endpoint"],
+)
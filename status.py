@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from config import STATUS
+from metrics import registry, FLOOD_WAITS
+
+logger = logging.getLogger(__name__)
+
+
+class StatusRenderer:
+    """
+    Background editor for progress messages.
+
+    Transfers call publish(), which only records the newest text for a message
+    and returns immediately. A single loop applies the edits: updates for the
+    same message are coalesced, each message is edited at most once every
+    STATUS.MIN_INTERVAL seconds, all edits share a global budget of
+    STATUS.EDITS_PER_SECOND, and a FloodWait pauses the loop instead of the
+    transfer that published the text.
+    """
+
+    def __init__(self, edits_per_second: float = STATUS.EDITS_PER_SECOND, min_interval: float = STATUS.MIN_INTERVAL):
+        self.spacing = 1 / max(edits_per_second, 0.1)
+        self.min_interval = min_interval
+        # (chat_id, message_id) -> (message, text, reply_markup), oldest first
+        self.pending = OrderedDict()
+        self.last_edit = {}
+        self.last_text = {}
+        self.blocked_until = 0.0
+        self.edits = 0
+        self.flood_waits = 0
+        self._wakeup = None
+        self._task = None
+
+    @staticmethod
+    def _key(message):
+        return message.chat.id, message.id
+
+    def publish(self, message, text: str, reply_markup=None):
+        """Queue the latest text for a message. Never blocks."""
+        if message is None:
+            return
+        key = self._key(message)
+        if self.last_text.get(key) == text:
+            return
+        # keep the original slot so busy messages cannot starve older ones
+        self.pending[key] = (message, text, reply_markup)
+        self._ensure_running()
+        self._wakeup.set()
+
+    def forget(self, message):
+        """Drop pending updates of a message that is being deleted or finalised."""
+        if message is None:
+            return
+        key = self._key(message)
+        self.pending.pop(key, None)
+        self.last_edit.pop(key, None)
+        self.last_text.pop(key, None)
+
+    async def finish(self, message, text: str, reply_markup=None):
+        """Final edit (error, done): replaces anything pending and is sent right away."""
+        if message is None:
+            return
+        self.forget(message)
+        try:
+            await message.edit_text(text, reply_markup=reply_markup)
+        except Exception:
+            pass
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _next_ready(self, now: float):
+        """First pending message allowed to be edited now, and the wait for the next one."""
+        soonest = None
+        for key in self.pending:
+            ready_at = self.last_edit.get(key, 0) + self.min_interval
+            if ready_at <= now:
+                return key, 0
+            soonest = ready_at if soonest is None else min(soonest, ready_at)
+        return None, (soonest - now if soonest is not None else None)
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            key, wait = self._next_ready(now)
+            if key is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            message, text, reply_markup = self.pending.pop(key)
+            self.last_edit[key] = now
+            try:
+                await message.edit_text(text, reply_markup=reply_markup)
+                self.last_text[key] = text
+                self.edits += 1
+            except FloodWait as e:
+                self.flood_waits += 1
+                FLOOD_WAITS.inc(source="status")
+                self.blocked_until = time.monotonic() + e.value
+                # retry this text later unless a newer one arrived meanwhile
+                self.pending.setdefault(key, (message, text, reply_markup))
+                logger.warning(f"Status edits paused for {e.value}s (FloodWait)")
+            except MessageNotModified:
+                self.last_text[key] = text
+            except Exception as e:
+                logger.debug(f"Status edit failed: {e}")
+            # global edit budget
+            await asyncio.sleep(self.spacing)
+
+
+status_renderer = StatusRenderer()
+registry.callback("mnbot_status_edits_total", "Progress message edits sent", lambda: status_renderer.edits, kind="counter")
+registry.callback("mnbot_status_pending", "Progress messages waiting for an edit", lambda: len(status_renderer.pending))
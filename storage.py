@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+
+from config import STORAGE
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class StorageError(Exception):
+    """A file can never fit into the temp storage."""
+
+
+class TempStorage:
+    """
+    Owns the directory downloads are written to.
+
+    A download reserves its full size before it starts and waits while the
+    quota (STORAGE.QUOTA, 0 for none) or the free disk space minus
+    STORAGE.MIN_FREE has no room for it. Bytes already on disk for a path,
+    such as a resumable partial file, count towards its reservation. Files are
+    deleted as soon as their task releases them, and a sweep removes files no
+    task holds once they are older than STORAGE.ORPHAN_AGE.
+    """
+
+    SWEEP_INTERVAL = 3600
+    WAIT_POLL = 10
+
+    def __init__(self, root: str = STORAGE.DIR, quota: int = STORAGE.QUOTA, min_free: int = STORAGE.MIN_FREE):
+        self.root = root
+        self.quota = quota
+        self.min_free = min_free
+        # path -> reserved bytes
+        self.reserved = {}
+        self._changed = None
+        self._sweeper = None
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    # ---------- accounting ----------
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _files(self):
+        try:
+            with os.scandir(self.root) as entries:
+                return [e for e in entries if e.is_file(follow_symlinks=False)]
+        except OSError:
+            return []
+
+    def _held(self, path: str) -> bool:
+        # a reserved download also owns its sidecar files (e.g. the journal)
+        return any(path == p or path.startswith(p + ".") for p in self.reserved)
+
+    def _outstanding(self) -> int:
+        """Reserved bytes not written yet."""
+        return sum(max(0, size - self._size(path)) for path, size in self.reserved.items())
+
+    def _fits(self, path: str, size: int) -> bool:
+        return self._room_for(max(0, size - self._size(path)))
+
+    def _room_for(self, needed: int) -> bool:
+        outstanding = self._outstanding()
+        if self.quota:
+            used = sum(e.stat().st_size for e in self._files())
+            if used + outstanding + needed > self.quota:
+                return False
+        free = shutil.disk_usage(self.root).free
+        return free - outstanding - needed >= self.min_free
+
+    def _evict(self, path: str) -> bool:
+        """Drop files nobody holds, oldest first, until the reserved `path` fits. False if nothing was left to drop."""
+        candidates = sorted((e for e in self._files() if not self._held(e.path)), key=lambda e: e.stat().st_mtime)
+        for entry in candidates:
+            logger.info(f"Evicting {entry.name} to make room")
+            self._remove(entry.path)
+            if self._fits(path, self.reserved.get(path, 0)):
+                return True
+        return False
+
+    # ---------- reservations ----------
+    def has_room(self, size: int) -> bool:
+        """Whether `size` more bytes fit right now, for optional work that should not wait."""
+        return self._room_for(size)
+
+    async def reserve(self, path: str, size: int, on_wait=None):
+        """
+        Reserve `size` bytes for `path`, waiting until they fit. on_wait() is
+        called once if the caller has to wait. Raises StorageError when the
+        file can never fit.
+        """
+        if self.quota and size > self.quota:
+            raise StorageError(f"File is larger than the storage quota ({size} > {self.quota} bytes)")
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        waited = False
+        while not self._fits(path, size):
+            if not self.reserved:
+                # no download will free anything, only stale files can make room
+                self.reserved[path] = size
+                fits = self._evict(path)
+                del self.reserved[path]
+                if not fits:
+                    raise StorageError("Not enough disk space for this file")
+                continue
+            if not waited and on_wait:
+                on_wait()
+            waited = True
+            self._changed.clear()
+            try:
+                # disk space can also be freed outside of this process
+                await asyncio.wait_for(self._changed.wait(), timeout=self.WAIT_POLL)
+            except asyncio.TimeoutError:
+                pass
+        self.reserved[path] = size
+
+    def release(self, path: str, delete: bool = True):
+        """End a reservation, deleting the file unless it is kept for a later resume."""
+        self.reserved.pop(path, None)
+        if delete:
+            self._remove(path)
+        if self._changed is not None:
+            self._changed.set()
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Failed to delete {path}: {e}")
+
+    # ---------- orphan sweep ----------
+    def sweep(self, max_age: int = STORAGE.ORPHAN_AGE) -> int:
+        """Delete files no task holds that were last written more than max_age seconds ago."""
+        cutoff = time.time() - max_age
+        removed = 0
+        for entry in self._files():
+            if self._held(entry.path):
+                continue
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+            except OSError:
+                continue
+            self._remove(entry.path)
+            removed += 1
+        if removed:
+            logger.info(f"Removed {removed} orphaned temp files from {self.root}")
+            if self._changed is not None:
+                self._changed.set()
+        return removed
+
+    async def _sweep_loop(self):
+        while True:
+            self.sweep()
+            await asyncio.sleep(self.SWEEP_INTERVAL)
+
+    def start(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+
+temp_storage = TempStorage()
+registry.callback("mnbot_temp_reserved_bytes", "Disk space reserved by running downloads", lambda: sum(list(temp_storage.reserved.values())))
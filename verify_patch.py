@@ -1,40 +1,125 @@
 import aiohttp
+import logging
 import secrets
+import time
 from datetime import datetime, timedelta
-from motor.motor_asyncio import AsyncIOMotorClient
 from pyrogram.types import Message
-from config import DATABASE
+from database import database
+from cache import TTLCache, SingleFlight
+from metrics import registry, cache_stats
 import os
 
+logger = logging.getLogger(__name__)
+
 # Load verification settings from environment
 IS_VERIFY = os.environ.get("IS_VERIFY", "False").lower() in ("true", "1", "yes")
 SHORTLINK_URL = os.environ.get("SHORTLINK_URL", "linkshortify.com")
 SHORTLINK_API = os.environ.get("SHORTLINK_API", "353689935e1e4ac6c70ba88c7e6e71dc6fe1e8c0")
 HOW_TO_VERIFY = os.environ.get('HOW_TO_VERIFY', "https://t.me/mntgxo/22")
+VERIFY_CACHE_SIZE = int(os.environ.get("VERIFY_CACHE_SIZE", 10000))
+SHORTLINK_TIMEOUT = float(os.environ.get("SHORTLINK_TIMEOUT", 5))
+# consecutive shortener failures before falling back to raw links, and for how long
+SHORTLINK_MAX_FAILURES = int(os.environ.get("SHORTLINK_MAX_FAILURES", 3))
+SHORTLINK_COOLDOWN = int(os.environ.get("SHORTLINK_COOLDOWN", 60))
+# a token is handed out again while it has at least this many seconds left
+TOKEN_REUSE_MARGIN = 5 * 60
+
+# MongoDB collections, served by the shared client opened in MN_Bot.start
+USERS_COL = "verifyusers"
+TOKENS_COL = "verifytokens"
+
+# verified users -> True, each entry expires together with the user's verification
+verified_cache = TTLCache(maxsize=VERIFY_CACHE_SIZE)
+registry.callback(
+    "mnbot_verify_cache_total", "Verified-user cache lookups", cache_stats(verified=verified_cache),
+    kind="counter", labels=["cache", "result"],
+)
+
+def cache_verified(user_id: int, expires_at: datetime):
+    ttl = (expires_at - datetime.utcnow()).total_seconds()
+    if ttl > 0:
+        verified_cache.set(user_id, True, ttl=ttl)
+
+# ---------- Shortlink client ----------
+class CircuitBreaker:
+    """
+    Opens after max_failures consecutive failures. While open, calls are
+    skipped for `cooldown` seconds; after that one trial call is let through
+    and its result closes or re-opens the breaker.
+    """
+
+    def __init__(self, max_failures: int, cooldown: float):
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.trial or time.monotonic() - self.opened_at < self.cooldown:
+            return False
+        self.trial = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self):
+        self.failures += 1
+        self.trial = False
+        if self.failures >= self.max_failures:
+            if self.opened_at is None:
+                logger.warning(f"Shortlink service degraded, using raw links for {self.cooldown}s")
+            self.opened_at = time.monotonic()
 
-# MongoDB setup
-mongo_client = AsyncIOMotorClient(DATABASE.URI)
-mdb = mongo_client[DATABASE.NAME]
-users_col = mdb["verifyusers"]
-tokens_col = mdb["verifytokens"]
 
-# Shorten a URL using shortlink service
-async def short_link(url: str) -> str:
+shortlink_breaker = CircuitBreaker(SHORTLINK_MAX_FAILURES, SHORTLINK_COOLDOWN)
+_shortlink_session = None
+# concurrent messages of one unverified user share one link
+_link_flight = SingleFlight()
+
+def get_shortlink_session() -> aiohttp.ClientSession:
+    global _shortlink_session
+    if _shortlink_session is None or _shortlink_session.closed:
+        _shortlink_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=SHORTLINK_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=10, ttl_dns_cache=300),
+        )
+    return _shortlink_session
+
+async def close_shortlink_session():
+    global _shortlink_session
+    if _shortlink_session is not None and not _shortlink_session.closed:
+        await _shortlink_session.close()
+    _shortlink_session = None
+
+# Shorten a URL using shortlink service, None when it is unavailable
+async def short_link(url: str):
+    if not shortlink_breaker.allow():
+        return None
     try:
-        async with aiohttp.ClientSession() as session:
-            params = {"api": SHORTLINK_API, "url": url}
-            async with session.get(f"https://{SHORTLINK_URL}/api", params=params) as resp:
-                data = await resp.json()
-                return data.get("shortenedUrl", url)
+        params = {"api": SHORTLINK_API, "url": url}
+        async with get_shortlink_session().get(f"https://{SHORTLINK_URL}/api", params=params) as resp:
+            data = await resp.json(content_type=None)
+        short = data.get("shortenedUrl")
+        if not short:
+            raise ValueError(f"no shortenedUrl in response: {data}")
     except Exception as e:
-        print(f"[Shortlink Error] {e}")
-        return url
+        logger.error(f"Shortlink Error: {e}")
+        shortlink_breaker.failure()
+        return None
+    shortlink_breaker.success()
+    return short
 
 # Generate a secure token and store it
 async def create_verification_token(user_id: int) -> str:
     token = secrets.token_urlsafe(16)
-    await tokens_col.delete_many({"user_id": user_id})
-    await tokens_col.insert_one({
+    await database[TOKENS_COL].delete_many({"user_id": user_id})
+    await database[TOKENS_COL].insert_one({
         "user_id": user_id,
         "token": token,
         "used": False,
@@ -43,40 +128,61 @@ async def create_verification_token(user_id: int) -> str:
     })
     return token
 
-# Build short verification link
+# Build short verification link, reusing the user's unexpired token
 async def build_verification_link(bot_username: str, user_id: int) -> str:
-    token = await create_verification_token(user_id)
+    return await _link_flight.do(user_id, lambda: _build_verification_link(bot_username, user_id))
+
+async def _build_verification_link(bot_username: str, user_id: int) -> str:
+    record = await database[TOKENS_COL].find_one({
+        "user_id": user_id,
+        "used": False,
+        "expires_at": {"$gt": datetime.utcnow() + timedelta(seconds=TOKEN_REUSE_MARGIN)},
+    })
+    if record and record.get("short_url"):
+        return record["short_url"]
+    token = record["token"] if record else await create_verification_token(user_id)
     full_link = f"https://t.me/{bot_username}?start=verify_{token}"
-    return await short_link(full_link)
+    short = await short_link(full_link)
+    if not short:
+        # shortener down: the raw deep link still verifies the user
+        return full_link
+    await database[TOKENS_COL].update_one({"token": token}, {"$set": {"short_url": short}})
+    return short
 
 # Set user as verified
 async def set_verified(user_id: int):
     expires_at = datetime.utcnow() + timedelta(hours=12)
-    await users_col.update_one(
+    await database[USERS_COL].update_one(
         {"_id": user_id},
         {"$set": {"is_verified": True, "expires_at": expires_at}},
         upsert=True
     )
+    verified_cache.pop(user_id)
+    cache_verified(user_id, expires_at)
 
 # Check if user is verified and not expired
 async def is_verified(user_id: int) -> bool:
-    user = await users_col.find_one({"_id": user_id})
+    # hot path: a verified user costs no database round trip
+    if verified_cache.get(user_id):
+        return True
+    user = await database[USERS_COL].find_one({"_id": user_id})
     if not user or not user.get("is_verified"):
         return False
     if datetime.utcnow() > user.get("expires_at", datetime.utcnow()):
-        await users_col.update_one(
+        await database[USERS_COL].update_one(
             {"_id": user_id},
             {"$set": {"is_verified": False}, "$unset": {"expires_at": ""}}
         )
         return False
+    cache_verified(user_id, user["expires_at"])
     return True
 
 # Validate token and mark user as verified
 async def validate_token_and_verify(user_id: int, token: str) -> bool:
-    record = await tokens_col.find_one({"token": token})
+    record = await database[TOKENS_COL].find_one({"token": token})
     if not record or record["used"] or record["user_id"] != user_id or datetime.utcnow() > record["expires_at"]:
         return False
-    await tokens_col.update_one({"_id": record["_id"]}, {"$set": {"used": True}})
+    await database[TOKENS_COL].update_one({"_id": record["_id"]}, {"$set": {"used": True}})
     await set_verified(user_id)
     return True
 
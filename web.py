@@ -0,0 +1,173 @@
+import asyncio
+import hmac
+import logging
+
+from aiohttp import web
+
+from config import WEB, WORKER
+from database import database
+from metrics import registry, hit_rates
+from plugins.tera import queue
+
+logger = logging.getLogger(__name__)
+
+routes = web.RouteTableDef()
+
+
+# ---------- health ----------
+@routes.get("/")
+async def home(request):
+    return web.Response(text="MnBot is running!")
+
+
+@routes.get("/health")
+async def health(request):
+    """Liveness: the event loop answers."""
+    return web.json_response({"ok": True})
+
+
+@routes.get("/ready")
+async def ready(request):
+    """Readiness: Telegram and MongoDB are reachable and the backlog is below WEB.MAX_BACKLOG."""
+    client = request.app["client"]
+    backlog = sum(len(q) for q in list(queue.queues.values()))
+    checks = {
+        "telegram": bool(client and client.is_connected),
+        "database": await database_ok(),
+        "backlog": backlog < WEB.MAX_BACKLOG,
+        "accepting": not queue.draining,
+    }
+    body = {"ready": all(checks.values()), "checks": checks, "backlog": backlog, "running": len(queue.running)}
+    return web.json_response(body, status=200 if body["ready"] else 503)
+
+
+async def database_ok() -> bool:
+    if database.db is None:
+        return False
+    try:
+        await asyncio.wait_for(database.db.command("ping"), timeout=2)
+        return True
+    except Exception:
+        return False
+
+
+@routes.get("/metrics")
+async def metrics(request):
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+@routes.get("/status")
+async def status(request):
+    return web.json_response({
+        "role": WORKER.ROLE,
+        "worker": WORKER.ID,
+        "cache_hit_rates": hit_rates(),
+        "metrics": registry.snapshot(),
+    })
+
+
+# ---------- admin ----------
+@web.middleware
+async def admin_auth(request, handler):
+    if request.path.startswith("/admin"):
+        if not WEB.ADMIN_TOKEN:
+            raise web.HTTPNotFound()
+        given = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(given, WEB.ADMIN_TOKEN):
+            raise web.HTTPUnauthorized()
+    return await handler(request)
+
+
+def user_id_of(request) -> int:
+    try:
+        return int(request.match_info["user_id"])
+    except ValueError:
+        raise web.HTTPBadRequest(text="user_id must be an integer")
+
+
+@routes.get("/admin/queues")
+async def admin_queues(request):
+    users = {
+        str(uid): {
+            "queued": len(items),
+            "running": queue.running.count(uid),
+            "waiting_for_slot": uid in queue.waiters,
+            "lane": queue.lane_of(uid),
+            "cancelled": queue.cancelled.get(uid, False),
+            "tasks": [
+                {"url": t["url"], "name": (t["info"] or {}).get("name"), "size": (t["info"] or {}).get("size_str")}
+                for t in items
+            ],
+        }
+        for uid, items in list(queue.queues.items()) if items
+    }
+    return web.json_response({
+        "draining": queue.draining,
+        "max_concurrent": queue.max_concurrent,
+        "running": sorted(queue.running),
+        "users": users,
+    })
+
+
+@routes.get("/admin/queues/{user_id}")
+async def admin_user_queue(request):
+    user_id = user_id_of(request)
+    tasks = await queue.store.load_user_tasks(user_id)
+    return web.json_response({
+        "user_id": user_id,
+        "position": queue.position(user_id) if queue.queues.get(user_id) else None,
+        "stored_tasks": [
+            {"id": str(t["_id"]), "url": t["url"], "state": t["state"], "worker": t.get("worker")}
+            for t in tasks
+        ],
+    })
+
+
+@routes.post("/admin/queues/{user_id}/cancel")
+async def admin_cancel(request):
+    user_id = user_id_of(request)
+    queue.cancel_queue(user_id)
+    await queue.store.cancel_user(user_id)
+    logger.info(f"Queue of {user_id} cancelled through the admin API")
+    return web.json_response({"cancelled": user_id})
+
+
+@routes.post("/admin/drain")
+async def admin_drain(request):
+    queue.drain()
+    return web.json_response({"draining": True, "running": len(queue.running)})
+
+
+@routes.post("/admin/resume")
+async def admin_resume(request):
+    queue.resume()
+    return web.json_response({"draining": False})
+
+
+class WebServer:
+    """aiohttp app on the bot's own event loop, bound to WEB.PORT."""
+
+    def __init__(self, client=None):
+        self.app = web.Application(middlewares=[admin_auth])
+        self.app["client"] = client
+        self.app.add_routes(routes)
+        self.runner = None
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "0.0.0.0", WEB.PORT)
+        try:
+            await site.start()
+        except OSError as e:
+            # e.g. a second worker on the same host without its own PORT
+            logger.error(f"Web server not started, port {WEB.PORT} unavailable: {e}")
+            await self.runner.cleanup()
+            self.runner = None
+            return
+        logger.info(f"Web server listening on port {WEB.PORT}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None